@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import random
+import struct
+import platform
+import argparse
+import tempfile
+import tracemalloc
+from array import array
+
+import decoder
+
+# Strings the device writes before the variable names (language, date, car, ...)
+HEADER_STRINGS = ["en.English", "Thu Oct 23 16:31:40 2025", "US.US", "1.0", "SYNTHETIC", "12345678976543210",
+                  "Canbus", "20251023163140"]
+UNITS = ["Nm", "V", "degree C", "   ", "rpm", "MPa", "ms", "%", "km/h"]
+LABELS = ["ON", "OFF", "Idle Speed", "Part Load", "Standby"]
+
+
+def make_synthetic_tc(file_path: str, variables: int, rows: int, sparsity: float = 0.1, distinct: int = 64,
+                      change_rate: float = 0.2, seed: int = 0) -> None:
+    """
+    Writes a synthetic TC file with the layout decode_binary_data expects (see the Protocol section
+    of the README): a header, the map between variables and units (10 00 05 00), the sequence of
+    measurements (10 00 04 00) and the string table (10 00 02 00).
+
+    Args:
+        variables: Number of variables, up to 256 like the device.
+        rows: Number of measurements.
+        sparsity: Fraction of the cells that are not measured, from 0 to 1. Variables start reporting
+                  at evenly spread measurements, centered so that the fraction is exact.
+        distinct: Distinct values per variable. Every fifth variable uses labels (e.g. "ON"/"OFF").
+        change_rate: Probability that a variable changes its value from one measurement to the next.
+        seed: Seed of the random values, the same arguments always give the same file.
+    """
+    if not 0 < variables <= 256:
+        raise ValueError("variables must be between 1 and 256")
+    if not 0 <= sparsity <= 1:
+        raise ValueError("sparsity must be between 0 and 1")
+
+    generator = random.Random(seed)
+
+    # --- String table: header strings, variable names, units, then the values of each variable ---
+    strings = list(HEADER_STRINGS)
+    variable_indexes = []
+    for variable in range(variables):
+        strings.append(f"Synthetic Variable {variable:03d}")
+        variable_indexes.append(len(strings))
+    unit_indexes = []
+    for variable in range(variables):
+        unit_indexes.append(len(HEADER_STRINGS) + variables + 1 + variable % len(UNITS))
+    strings.extend(UNITS)
+
+    value_indexes = []
+    for variable in range(variables):
+        first = len(strings) + 1
+        if variable % 5 == 4:
+            strings.extend(LABELS)
+        else:
+            strings.extend(f"{generator.uniform(-100, 5000):.3f}" for _ in range(distinct))
+        value_indexes.append(range(first, len(strings) + 1))
+
+    string_table = bytearray()
+    for text in strings:
+        encoded = text.encode('ascii')
+        string_table.append(len(encoded) + 3)
+        string_table += b"\x00" + encoded + b"\x00"
+
+    # --- Map between variables and units: repeated 16 bit indexes, zero terminated ---
+    variables_and_units = bytearray()
+    for index in variable_indexes + unit_indexes:
+        variables_and_units += struct.pack("<HH", index, index)
+    variables_and_units += bytes(8)
+
+    header = b"LSX8" + bytes(290)
+    row_format = struct.Struct(f"<{variables}I")
+    measurements_length = rows * row_format.size
+
+    # Offsets of the section markers (10 00 0k 00). Each marker is preceded by two zero bytes.
+    variables_units_marker = len(header)
+    measurements_marker = variables_units_marker + 16 + len(variables_and_units)
+    parameters_marker = measurements_marker + 16 + measurements_length
+
+    # The start rows are spread evenly over [first, last], whose middle is the sparsity
+    first, last = max(0.0, 2 * sparsity - 1), min(1.0, 2 * sparsity)
+    start_rows = [int(rows * (first + (last - first) * (variable + 0.5) / variables)) for variable in range(variables)]
+
+    with open(file_path, 'wb') as f:
+        f.write(header)
+        f.write(struct.pack("<4I", 0x00050010, measurements_marker, len(variables_and_units), variables * 4))
+        f.write(variables_and_units)
+
+        f.write(struct.pack("<4I", 0x00040010, 0, measurements_length, variables * 4))
+        current = [generator.choice(value_indexes[variable]) for variable in range(variables)]
+        changes_per_row = max(1, int(variables * change_rate))
+        batch = array('I')
+        for row in range(rows):
+            for _ in range(changes_per_row):
+                variable = generator.randrange(variables)
+                current[variable] = generator.choice(value_indexes[variable])
+            batch.extend(index if row >= start_rows[variable] else 0 for variable, index in enumerate(current))
+            if len(batch) >= 1 << 20:
+                f.write(batch_bytes(batch))
+                batch = array('I')
+        f.write(batch_bytes(batch))
+
+        f.write(struct.pack("<4I", 0x00020010, 0, len(string_table), len(strings)))
+        f.write(string_table)
+
+    assert os.path.getsize(file_path) == parameters_marker + 16 + len(string_table)
+
+
+def batch_bytes(batch: array) -> bytes:
+    # The file is little endian
+    if sys.byteorder == "big":
+        batch.byteswap()
+    return batch.tobytes()
+
+
+def run_stage(stages: dict, name: str, measure_memory: bool, function, *args):
+    """Runs one stage, stores its wall time (and peak traced memory) in stages and returns its result."""
+    if measure_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - started
+    stage = {'seconds': seconds}
+    if measure_memory:
+        stage['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    stages[name] = stage
+    return result
+
+
+def benchmark_file(file_path: str, measure_memory: bool) -> dict:
+    """Times (and optionally traces the memory of) each decoder stage on one file."""
+    stages = {}
+    with open(file_path, 'rb') as f:
+        content = f.read()
+
+    sections = run_stage(stages, 'decode_binary_data', measure_memory, decoder.decode_binary_data, content)
+    parameters_map = run_stage(stages, 'process_parameters_map', measure_memory,
+                               decoder.process_parameters_map, sections['ParametersMap'])
+    variables_and_units = run_stage(stages, 'process_variables_units', measure_memory,
+                                    decoder.process_variables_units, sections['VariablesAndUnitsSeq'])
+    variable_names = decoder.variables_and_units_to_string(parameters_map, variables_and_units)
+    run_stage(stages, 'process_measurements', measure_memory, decoder.process_measurements,
+              parameters_map, sections['MeasurementsSeq'], len(variable_names))
+    value_table = run_stage(stages, 'build_value_table', measure_memory, decoder.build_value_table, parameters_map)
+    # Like a conversion: the rows are decoded while the CSV is written
+    rows = decoder.iter_measurement_indexes(sections['MeasurementsSeq'][12:], len(variable_names))
+    run_stage(stages, 'tc_to_csv', measure_memory, decoder.tc_to_csv, file_path, variable_names, rows,
+              value_table['texts'])
+
+    return stages
+
+
+def run_benchmarks(variable_counts: list[int], row_counts: list[int], sparsities: list[float], repeat: int = 1,
+                   measure_memory: bool = True) -> dict:
+    """
+    Benchmarks the decoder on synthetic files for every combination of the parameters.
+    The fastest of the repeated runs is kept for the times, the memory is traced in a separate run,
+    so tracing does not slow the timed runs down.
+    """
+    cases = []
+    previous_directory = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # tc_to_csv writes into output/ of the working directory
+        os.chdir(directory)
+        os.mkdir("output")
+        try:
+            for variables in variable_counts:
+                for rows in row_counts:
+                    for sparsity in sparsities:
+                        file_path = f"synthetic_{variables}x{rows}.TC"
+                        make_synthetic_tc(file_path, variables, rows, sparsity)
+
+                        runs = [benchmark_file(file_path, False) for _ in range(repeat)]
+                        stages = {name: {'seconds': min(run[name]['seconds'] for run in runs)} for name in runs[0]}
+                        if measure_memory:
+                            for name, stage in benchmark_file(file_path, True).items():
+                                stages[name]['peak_bytes'] = stage['peak_bytes']
+
+                        case = {
+                            'variables': variables,
+                            'rows': rows,
+                            'sparsity': sparsity,
+                            'file_bytes': os.path.getsize(file_path),
+                            'stages': stages,
+                        }
+                        cases.append(case)
+                        print_case(case)
+                        os.remove(file_path)
+        finally:
+            os.chdir(previous_directory)
+
+    return {
+        'decoder_version': decoder.DECODER_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'cases': cases,
+    }
+
+
+def print_case(case: dict, baseline: dict = None) -> None:
+    print(f"{case['variables']} variables x {case['rows']} rows, sparsity {case['sparsity']}, "
+          f"{case['file_bytes']} bytes")
+    for name, stage in case['stages'].items():
+        line = f"  {name:<26}{stage['seconds']:10.4f} s"
+        if 'peak_bytes' in stage:
+            line += f"{stage['peak_bytes'] / 1024 / 1024:10.1f} MiB peak"
+        if baseline is not None and name in baseline['stages'] and baseline['stages'][name]['seconds'] > 0:
+            line += f"{stage['seconds'] / baseline['stages'][name]['seconds']:8.2f}x baseline"
+        print(line)
+
+
+def compare(results: dict, baseline_path: str) -> None:
+    """Prints the results next to the matching cases of an earlier results file."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print("-" * 50)
+    print(f"Compared with {baseline_path} (decoder version {baseline.get('decoder_version')}):")
+    for case in results['cases']:
+        matching = [old for old in baseline['cases']
+                    if (old['variables'], old['rows'], old['sparsity']) == (case['variables'], case['rows'], case['sparsity'])]
+        print_case(case, matching[0] if matching else None)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmarks the TC decoder stages on synthetic recordings.")
+    parser.add_argument("--variables", type=int, nargs="+", default=[16, 64, 256], help="variable counts (max 256)")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000], help="measurement counts")
+    parser.add_argument("--sparsity", type=float, nargs="+", default=[0.1], help="fractions of empty cells")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, the fastest is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory tracing")
+    parser.add_argument("--output", help="save the results as JSON into this file")
+    parser.add_argument("--compare", metavar="RESULTS", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    if any(not 0 < variables <= 256 for variables in args.variables):
+        parser.error("--variables must be between 1 and 256")
+    if any(not 0 <= sparsity <= 1 for sparsity in args.sparsity):
+        parser.error("--sparsity must be between 0 and 1")
+
+    results = run_benchmarks(args.variables, args.rows, args.sparsity, max(1, args.repeat), not args.no_memory)
+
+    if args.output:
+        with open(args.output, mode="w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"✅ Results saved as: {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,125 @@
 import os
+import io
+import sys
 import glob
 import csv
+import gzip
+import re
+import struct
+from array import array
+import time
+import json
+import hashlib
+import argparse
+import mmap
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from operator import itemgetter
+
+try:
+    import resource
+except ImportError:  # not available on Windows, peak RSS is not reported there
+    resource = None
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for the columnar engine
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed for the Parquet and Arrow output formats
+    pa = None
+    pq = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is only needed for zstd compressed CSV files
+    zstandard = None
+
+# Kinds of the values in the parameters map, see build_value_table
+VALUE_EMPTY = "empty"
+VALUE_INT = "int"
+VALUE_FLOAT = "float"
+VALUE_LABEL = "label"
+
+INT_PATTERN = re.compile(r"[+-]?\d+")
+FLOAT_PATTERN = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+
+# Bump whenever the decoder starts producing different output, so the cached conversions are redone.
+DECODER_VERSION = "4"
+# Output formats of the converted files: file extension and the name used in messages
+OUTPUT_FORMATS = {
+    'csv': ("csv", "CSV"),
+    'parquet': ("parquet", "Parquet"),
+    'arrow': ("arrow", "Arrow"),
+    'changes': ("changes.csv", "Change events"),
+}
+# Where the converted files are written, unless another directory is given
+OUTPUT_DIRECTORY = "output"
+# Compressions of the CSV output: file extension added after .csv
+CSV_COMPRESSIONS = {
+    'gzip': ".gz",
+    'zstd': ".zst",
+}
+# Measurements rendered before each write of the CSV writer
+CSV_BATCH_ROWS = 4096
+# Bucket sizes (in measurements) of the min/max/mean/count pyramid, see build_pyramid.
+# Each size must be a multiple of the previous one.
+PYRAMID_LEVELS = (16, 256, 4096)
+# Shared by all stages when profiling is off, see profile_stage
+NO_PROFILE = nullcontext()
+# Remembers which TC files were already converted into an output directory, see is_unchanged
+MANIFEST_FILENAME = ".manifest.json"
+# Extensions of the TC files and of the files converted from them, the longest first, see recording_name
+RECORDING_EXTENSIONS = sorted({".tc", *(f".{extension}" for extension, _ in OUTPUT_FORMATS.values()),
+                               *(f".csv{suffix}" for suffix in CSV_COMPRESSIONS.values())}, key=len, reverse=True)
+
+
+class TcFormatError(ValueError):
+    """
+    A TC file does not have the layout the decoder expects. Unlike an assert, it is raised under python -O too.
 
-def process_tc_files():
+    Attributes:
+        offset: The byte where the problem was found, counted from the start of the section,
+                or from the start of the file when section is None.
+        section: The name of the section (e.g. 'ParametersMap'), or None.
     """
-    Finds all .TC files in the current directory, reads them as binary,
-    and prints the data before and after the '08 04' hex sequence.
+
+    def __init__(self, message: str, offset: int, section: str = None):
+        where = f"byte {offset}" if section is None else f"byte {offset} of section {section}"
+        super().__init__(f"{message} (at {where})")
+        self.offset = offset
+        self.section = section
+
+
+def process_tc_files(jobs: int = None, force: bool = False, variables: list[str] = None, output_format: str = 'csv',
+                     profile: bool = False, profile_json: str = None, output_dir: str = OUTPUT_DIRECTORY,
+                     compression: str = None, pyramid: bool = True):
     """
-    
+    Finds all .TC files in the input directory, decodes them and writes one CSV (or Parquet/Arrow)
+    file per TC file into the output directory. Files that did not change since their last conversion
+    are skipped.
 
-    # Use glob to find all files ending with .TC in the current directory
-    tc_files = glob.glob("input/*.TC")
+    Args:
+        jobs: How many files are converted in parallel, in separate processes.
+              Defaults to the number of CPU cores.
+        force: Convert all files, even the unchanged ones.
+        variables: Only write these variables, given by name or regular expression (see select_columns).
+                   All variables when None.
+        output_format: One of OUTPUT_FORMATS.
+        profile: Measure every stage of every file and print a summary table at the end.
+        profile_json: Also append the measurements to this file, as one JSON object per line.
+        output_dir: The directory of the converted files (created when missing).
+        compression: Compress the CSV files, one of CSV_COMPRESSIONS. Uncompressed when None.
+        pyramid: Also write the pyramid of each CSV file for the viewer, see save_pyramid.
+    """
+    # Use glob to find all files ending with .TC in the input directory.
+    # Sorted, so the console output is the same on every run.
+    tc_files = sorted(glob.glob("input/*.TC"))
 
     if not tc_files:
         print("No .TC files found in the current directory.")
@@ -19,93 +128,1421 @@ def process_tc_files():
     print(f"Found {len(tc_files)} .TC file(s).")
     print("-" * 50)
 
-    for file_path in tc_files:
-        print(f"Processing file: {file_path}")
+    started = time.perf_counter()
 
-        try:
-            # Open the file in binary read mode ('rb')
-            with open(file_path, 'rb') as f:
-                content = f.read()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {} if force else load_manifest(output_dir)
+    skipped = [file_path for file_path in tc_files
+               if is_unchanged(file_path, manifest.get(file_path), variables, output_format, output_dir, compression,
+                               pyramid)]
+    tc_files = [file_path for file_path in tc_files if file_path not in skipped]
 
-            decoded_data = decode_binary_data(content)
-            parameters_map_raw = decoded_data['ParametersMap']
-            measurements_seq_raw = decoded_data['MeasurementsSeq']
-            variables_and_units_seq_raw = decoded_data['VariablesAndUnitsSeq']
+    converted = 0
+    total_rows = 0
+    total_bytes = 0
 
-            parameters_map = process_parameters_map(parameters_map_raw)
-            variables_and_units = process_variables_units(variables_and_units_seq_raw)
-            variables_with_units = variables_and_units_to_string(parameters_map, variables_and_units)
-            measurements = process_measurements(parameters_map, measurements_seq_raw, len(variables_with_units))
+    convert = partial(convert_tc_file, variables=variables, output_format=output_format, profile=profile,
+                      output_dir=output_dir, compression=compression, pyramid=pyramid)
 
-            tc_to_csv(file_path, variables_with_units, measurements)
+    stages = []
+    try:
+        with parallel_map(convert, tc_files, jobs) as results:
+            for result in results:
+                print(f"Processing file: {result['path']}")
+                if profile:
+                    stages.extend(dict(stage, file=result['path']) for stage in result['profile'])
+                if result['error'] is None:
+                    print(f"✅ {OUTPUT_FORMATS[output_format][1]} file saved as: {result['output_path']}")
+                    converted += 1
+                    total_rows += result['rows']
+                    total_bytes += result['bytes']
+                    manifest[result['path']] = {
+                        'size': result['bytes'],
+                        'mtime': result['mtime'],
+                        'sha256': result['sha256'],
+                        'decoder_version': DECODER_VERSION,
+                        'variables': variables,
+                        'output_format': output_format,
+                        'output_dir': output_dir,
+                        'compression': compression,
+                        'output_path': result['output_path'],
+                        'pyramid': pyramid,
+                        'pyramid_path': result['pyramid_path'],
+                    }
+                else:
+                    print(f"  ❌ {result['error']}")
+                    manifest.pop(result['path'], None)
+    finally:
+        save_manifest(manifest, output_dir)
+
+    print("-" * 50)
+    print(f"Converted {converted} of {len(tc_files)} file(s): {total_rows} rows, "
+          f"{total_bytes} bytes in {time.perf_counter() - started:.2f} seconds.")
+    if skipped:
+        print(f"Skipped {len(skipped)} unchanged file(s). Use --force to convert them again.")
+
+    if profile:
+        print_profile(stages)
+        if profile_json:
+            with open(profile_json, mode="a", encoding="utf-8") as f:
+                for stage in stages:
+                    f.write(json.dumps(stage) + "\n")
+            print(f"✅ Profile appended to: {profile_json}")
+
+
+@contextmanager
+def parallel_map(function, items: list, jobs: int = None):
+    """
+    Calls function on every item in up to jobs worker processes (default: the number of CPU cores),
+    or in this process when one is enough. Use as a context manager: it yields the results in the
+    order of items, as soon as each one is ready, and stops the workers at the end. When the block
+    fails (e.g. on Ctrl+C), the items that did not start yet are dropped instead of waited for.
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(items)))
 
-        except IOError as e:
-            print(f"  ❌ Error reading file {file_path}: {e}")
-        except Exception as e:
-            print(f"  ❌ An unexpected error occurred with {file_path}: {e}")
+    if jobs == 1:
+        yield map(function, items)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        yield executor.map(function, items)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def profile_stage(profile: list, name: str, bytes_processed: int = 0):
+    """
+    Measures one stage of a conversion, when profile is a list (otherwise it does nothing).
+
+    Use as a context manager. It yields the record of the stage (None when profiling is off), so the
+    stage can fill in 'rows', 'bytes' (its input) and 'output_bytes' (the size of the file it wrote). When it ends, the record gets the wall time in 'seconds',
+    'rows_per_second' and the 'peak_rss' of the process in bytes, and is appended to profile.
+    """
+    if profile is None:
+        return NO_PROFILE
+    return measure_stage(profile, name, bytes_processed)
+
+
+@contextmanager
+def measure_stage(profile: list, name: str, bytes_processed: int):
+    record = {'stage': name, 'bytes': bytes_processed, 'output_bytes': None, 'rows': None}
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - started
+        record['rows_per_second'] = record['rows'] / record['seconds'] if record['rows'] and record['seconds'] else None
+        record['peak_rss'] = peak_rss()
+        profile.append(record)
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, None where it is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def print_profile(stages: list[dict]) -> None:
+    """Prints the stage measurements of all files, summed up per stage."""
+    totals = {}
+    for stage in stages:
+        total = totals.setdefault(stage['stage'], {'seconds': 0.0, 'bytes': 0, 'output_bytes': 0, 'rows': 0,
+                                                   'peak_rss': 0})
+        total['seconds'] += stage['seconds']
+        total['bytes'] += stage['bytes'] or 0
+        total['output_bytes'] += stage['output_bytes'] or 0
+        total['rows'] += stage['rows'] or 0
+        total['peak_rss'] = max(total['peak_rss'], stage['peak_rss'] or 0)
 
     print("-" * 50)
+    print(f"{'Stage':<20}{'Seconds':>10}{'MB in':>10}{'MB out':>10}{'Rows/s':>12}{'Peak RSS MB':>14}")
+    for name, total in totals.items():
+        rows_per_second = f"{total['rows'] / total['seconds']:.0f}" if total['rows'] and total['seconds'] else "-"
+        output_mb = f"{total['output_bytes'] / 1e6:.2f}" if total['output_bytes'] else "-"
+        print(f"{name:<20}{total['seconds']:>10.3f}{total['bytes'] / 1e6:>10.2f}{output_mb:>10}{rows_per_second:>12}"
+              f"{total['peak_rss'] / 1e6:>14.1f}")
+
+
+def manifest_path(output_dir: str = OUTPUT_DIRECTORY) -> str:
+    """Each output directory has its own manifest: <output_dir>/.manifest.json."""
+    return os.path.join(output_dir, MANIFEST_FILENAME)
+
+
+def load_manifest(output_dir: str = OUTPUT_DIRECTORY) -> dict:
+    """
+    Loads the manifest of the files converted into output_dir: a dictionary keyed by TC file path, with the 'size',
+    'mtime', 'sha256' and 'decoder_version' of the file when it was converted, the selected
+    'variables', the 'output_format' and the 'output_path' of the converted file.
+    A missing or unreadable manifest is treated as empty, so everything gets converted.
+    """
+    try:
+        with open(manifest_path(output_dir), encoding="utf-8") as f:
+            return json.load(f)['files']
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def save_manifest(manifest: dict, output_dir: str = OUTPUT_DIRECTORY) -> None:
+    # Written to a temporary file first, so an interrupted run never leaves a broken manifest behind
+    with temporary_output(manifest_path(output_dir)) as temporary_path:
+        with open(temporary_path, mode="w", encoding="utf-8") as f:
+            json.dump({'files': manifest}, f, indent=1, sort_keys=True)
+
+
+def is_unchanged(file_path: str, entry: dict, variables: list[str] = None, output_format: str = 'csv',
+                 output_dir: str = OUTPUT_DIRECTORY, compression: str = None, pyramid: bool = True) -> bool:
+    """
+    Checks whether a TC file still matches its manifest entry, so its conversion can be skipped.
+    A conversion with a different selection of variables, output format, directory, compression or
+    pyramid setting never matches.
+    The content is compared by stat_if_unchanged, a new mtime of the same content is remembered in the entry.
+    """
+    if not entry or entry.get('decoder_version') != DECODER_VERSION:
+        return False
+    if entry.get('variables') != variables or entry.get('output_format') != output_format:
+        return False
+    # Entries written before these options existed were uncompressed, in the default directory
+    if entry.get('output_dir', OUTPUT_DIRECTORY) != output_dir or entry.get('compression') != compression:
+        return False
+    if not os.path.exists(entry.get('output_path') or ""):
+        return False
+    if entry.get('pyramid') != pyramid:
+        return False
+    if entry.get('pyramid_path') is not None and not os.path.exists(entry['pyramid_path']):
+        return False
+
+    stat = stat_if_unchanged(file_path, entry.get('size'), entry.get('mtime'), entry.get('sha256'))
+    if stat is None:
+        return False
+    entry['mtime'] = stat.st_mtime
+    return True
+
+
+def stat_if_unchanged(file_path: str, size: int, mtime: float, sha256: str):
+    """
+    The os.stat of a file when it still has the content it had with this size, mtime and hash,
+    otherwise None (also when it is missing).
+
+    Size and mtime are compared first, which costs only a stat. When just the mtime differs
+    (e.g. the file was copied again), the content hash decides.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+
+    if stat.st_size != size:
+        return None
+    if stat.st_mtime == mtime or file_sha256(file_path) == sha256:
+        return stat
+    return None
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def convert_tc_file(file_path: str, variables: list[str] = None, output_format: str = 'csv', profile: bool = False,
+                    output_dir: str = OUTPUT_DIRECTORY, compression: str = None, pyramid: bool = True) -> dict:
+    """
+    Decodes one .TC file and writes it as CSV. Runs in a worker process, so it does not print,
+    and it never raises: a failure is reported in the result, so one bad file does not stop the batch.
+
+    Args:
+        variables: Only write these variables, see select_columns. All variables when None.
+        output_format: One of OUTPUT_FORMATS.
+        profile: Measure the stages of the conversion, see profile_stage.
+        output_dir: The directory of the converted file.
+        compression: Compress the CSV file, one of CSV_COMPRESSIONS. Uncompressed when None.
+        pyramid: Also write the pyramid of a CSV file, see convert_tc_content.
+
+    Returns:
+        A dictionary with 'path', 'output_path', 'pyramid_path' (None when no pyramid was written),
+        'rows' (number of measurements), 'bytes' (size of the TC file), 'mtime' and 'sha256' of the
+        TC file, 'profile' (the stage measurements, or None) and 'error' (None on success, otherwise
+        the message to report).
+    """
+    result = {'path': file_path, 'output_path': None, 'pyramid_path': None, 'rows': 0, 'bytes': 0, 'mtime': None,
+              'sha256': None, 'profile': [] if profile else None, 'error': None}
+
+    try:
+        result['mtime'] = os.stat(file_path).st_mtime
+        with open_tc_file(file_path) as content:
+            result['bytes'] = len(content)
+            with profile_stage(result['profile'], 'read', len(content)):
+                result['sha256'] = hashlib.sha256(content).hexdigest()
+            result['output_path'], result['rows'], result['pyramid_path'] = convert_tc_content(
+                file_path, content, variables, output_format, result['profile'], output_dir, compression, pyramid)
+
+    except Exception as e:
+        result['error'] = error_message(file_path, e)
+
+    return result
+
+
+def error_message(file_path: str, error: Exception) -> str:
+    """The message reported for a file that could not be converted, by kind of error."""
+    if isinstance(error, IOError):
+        return f"Error reading file {file_path}: {error}"
+    if isinstance(error, TcFormatError):
+        return f"Not a valid TC file {file_path}: {error}"
+    return f"An unexpected error occurred with {file_path}: {error}"
+
+
+def convert_tc_content(file_path: str, content, variables: list[str] = None, output_format: str = 'csv',
+                       profile: list = None, output_dir: str = OUTPUT_DIRECTORY, compression: str = None,
+                       pyramid: bool = True) -> tuple[str, int, str]:
+    """
+    Decodes the content of a TC file (bytes or a mapped file) and writes it as CSV, Parquet, Arrow
+    or change events. A CSV file also gets its pyramid of summaries for the viewer (see build_pyramid),
+    which needs numpy and pyarrow.
+    The sections are memoryviews into the content, they are released when this function returns.
+
+    Args:
+        variables: Only write these variables, see select_columns. All variables when None.
+        output_format: One of OUTPUT_FORMATS.
+        profile: A list to append the stage measurements to, see profile_stage. None to not measure.
+        output_dir: The directory of the written files.
+        compression: Compress the CSV file, one of CSV_COMPRESSIONS. Uncompressed when None.
+        pyramid: Write the pyramid of a CSV file. Otherwise an older one is removed.
+
+    Returns:
+        The path of the written file, the number of measurements written and the path of the
+        pyramid (None when none was written).
+    """
+    decoded = decode_tc_content(content, profile)
+    columns = select_columns(decoded['variables'], variables)
+    measurements_length = len(decoded['measurements_seq'])
+
+    if output_format == 'changes':
+        variable_names = [decoded['variables'][column] for column in columns]
+        count = count_measurements(decoded['measurements_seq'], len(decoded['variables']))
+        # The changes are found while writing, so both are measured together
+        with profile_stage(profile, 'measurements+write', measurements_length) as stage:
+            changes = iter_changes(decoded['measurements_seq'], len(decoded['variables']), columns)
+            output_path = tc_to_changes(file_path, variable_names, changes, decoded['value_table'], count, output_dir)
+            if stage is not None:
+                stage['rows'] = count
+                stage['output_bytes'] = os.path.getsize(output_path)
+        return output_path, count, None
+
+    if output_format != 'csv':
+        with profile_stage(profile, 'measurements', measurements_length) as stage:
+            table = build_arrow_table(decoded, columns)
+            if stage is not None:
+                stage['rows'] = table.num_rows
+        with profile_stage(profile, 'write', table.nbytes) as stage:
+            output_path = tc_to_arrow(file_path, table, output_format, output_dir)
+            if stage is not None:
+                stage['rows'] = table.num_rows
+                stage['output_bytes'] = os.path.getsize(output_path)
+        return output_path, table.num_rows, None
+
+    measurements_seq = decoded['measurements_seq']
+    number_of_variables = len(decoded['variables'])
+    check_row_size(numbers_from_bytes(measurements_seq, 2), number_of_variables)
+    count = count_measurements(measurements_seq, number_of_variables)
+    variable_names = [decoded['variables'][column] for column in columns]
+
+    # The measurements are written while they are decoded, so both are measured together
+    with profile_stage(profile, 'measurements+write', measurements_length) as stage:
+        rows = iter_measurement_indexes(measurements_seq[12:], number_of_variables, columns)
+        if columns != sorted(columns):
+            # The indexes come in file order, put them in the requested order
+            order = sorted(columns)
+            rows = map(itemgetter(*[order.index(column) for column in columns]), rows)
+        output_path = tc_to_csv(file_path, variable_names, rows, decoded['value_table']['texts'], output_dir,
+                                compression)
+        if stage is not None:
+            stage['rows'] = count
+            stage['output_bytes'] = os.path.getsize(output_path)
+
+    written_pyramid = None
+    if pyramid and np is not None and pa is not None:
+        with profile_stage(profile, 'pyramid', measurements_length) as stage:
+            written_pyramid = save_pyramid(output_path, build_pyramid(decoded, columns))
+            if stage is not None:
+                stage['rows'] = count
+                stage['output_bytes'] = os.path.getsize(written_pyramid)
+    elif os.path.exists(pyramid_path(output_path)):
+        # Would describe an older version of the file
+        os.remove(pyramid_path(output_path))
+
+    return output_path, count, written_pyramid
+
+
+def decode_tc_content(content, profile: list = None) -> dict:
+    """
+    Decodes everything of a TC file except the measurements themselves.
+
+    Args:
+        content: The TC file, as bytes or a mapped file.
+        profile: A list to append the stage measurements to, see profile_stage. None to not measure.
+
+    Returns:
+        A dictionary with 'parameters_map' (the string table), 'variables' (the column names from
+        variables_and_units_to_string), 'variables_and_units' (the same as (variable, unit) pairs),
+        'value_table' (see build_value_table) and 'measurements_seq' (the raw MeasurementsSeq section,
+        a memoryview into the content).
+    """
+    with profile_stage(profile, 'sections', len(content)):
+        decoded_data = decode_binary_data(content)
+    parameters_map_raw = decoded_data['ParametersMap']
+    measurements_seq_raw = decoded_data['MeasurementsSeq']
+    variables_and_units_seq_raw = decoded_data['VariablesAndUnitsSeq']
+
+    with profile_stage(profile, 'string_table', len(parameters_map_raw)):
+        parameters_map = process_parameters_map(parameters_map_raw)
+        value_table = build_value_table(parameters_map)
+    with profile_stage(profile, 'variables', len(variables_and_units_seq_raw)):
+        variables_and_units = process_variables_units(variables_and_units_seq_raw)
+        variables_with_units = variables_and_units_to_string(parameters_map, variables_and_units)
+
+    return {
+        'parameters_map': parameters_map,
+        'variables': variables_with_units,
+        'variables_and_units': variables_and_units_to_pairs(parameters_map, variables_and_units),
+        'value_table': value_table,
+        'measurements_seq': measurements_seq_raw,
+    }
+
+
+def read_header(file_path: str, variables: list[str] = None) -> list[str]:
+    """
+    Returns the column names of a TC file, as "Variable (unit)" strings, without decoding its measurements.
+
+    Args:
+        variables: Only return these variables, see select_columns.
+    """
+    with open_tc_file(file_path) as content:
+        decoded = decode_tc_content(content)
+        columns = select_columns(decoded['variables'], variables)
+        return [decoded['variables'][column] for column in columns]
+
+
+def iter_measurements(file_path: str, variables: list[str] = None, batch_size: int = None):
+    """
+    Yields the measurements of a TC file one at a time, straight from the mapped MeasurementsSeq section,
+    so memory use does not grow with the length of the recording. Use read_header for the column names.
+
+    Args:
+        file_path: Path of the .TC file.
+        variables: The variables to yield, by name or regular expression (see select_columns).
+                   All variables when None. Only the selected variables are decoded.
+        batch_size: When given, yields lists of up to batch_size measurements instead of single ones.
+
+    Yields:
+        Measurements as lists of value strings, in the order of the header. Values that were
+        not measured yet are "".
+    """
+    with open_tc_file(file_path) as content:
+        decoded = decode_tc_content(content)
+        columns = select_columns(decoded['variables'], variables)
+        rows = iter_measurement_values(decoded['parameters_map'], decoded['measurements_seq'], len(decoded['variables']),
+                                       decoded['value_table'], columns)
+
+        if batch_size is None:
+            yield from rows
+            return
+
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def select_columns(variable_names: list[str], variables: list[str] = None) -> list[int]:
+    """
+    Finds the positions of the requested variables among the column names.
+
+    Args:
+        variable_names: Column names, as returned by variables_and_units_to_string.
+        variables: Requested variables, as "Variable (unit)", just "Variable", or a regular expression
+                   searched in "Variable (unit)". Names are tried first, so names containing
+                   brackets (e.g. "Air Temperature Sensor Voltage[HFM]") need no escaping.
+                   All columns when None.
+
+    Returns:
+        Column positions, in the order the variables were requested.
+
+    Raises:
+        ValueError: When a requested variable matches nothing in the recording.
+    """
+    if variables is None:
+        return list(range(len(variable_names)))
+
+    columns = []
+    for variable in variables:
+        matches = [column for column, name in enumerate(variable_names)
+                   if name == variable or name.startswith(variable + " (")]
+        if not matches:
+            try:
+                pattern = re.compile(variable)
+            except re.error as e:
+                raise ValueError(f"Variable not found in the recording: {variable} (not a valid regular expression: {e})")
+            matches = [column for column, name in enumerate(variable_names) if pattern.search(name)]
+        if not matches:
+            raise ValueError(f"Variable not found in the recording: {variable}")
+        columns.extend(column for column in matches if column not in columns)
+    return columns
+
+
+@contextmanager
+def open_tc_file(file_path: str):
+    """
+    Memory maps a TC file read-only, so it is never loaded into RAM as a whole.
+
+    Yields the mapped file. It supports len(), find() and the buffer protocol, so it can be passed
+    to decode_binary_data like the bytes of the file. Sections handed out as memoryviews must not
+    be used after the with block ends.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can not be mapped
+            yield b""
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        yield mapped
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # A section view is still referenced (e.g. by the traceback of an exception).
+            # The map is unmapped as soon as the last view is garbage collected.
+            pass
+
+
+def build_arrow_table(decoded: dict, columns: list[int]):
+    """
+    Builds a typed pyarrow table of the measurements, one column per selected variable.
+
+    Variables whose measured values are all numbers become float64 columns, the others
+    (e.g. "ON"/"OFF") dictionary encoded string columns. Values that were not measured yet
+    are nulls. Each field carries the variable name and unit as metadata.
+
+    Args:
+        decoded: The result of decode_tc_content.
+        columns: Positions of the variables to include, see select_columns.
+    """
+    if pa is None:
+        raise ImportError("The Parquet and Arrow output formats require pyarrow (pip install pyarrow).")
+
+    count = count_measurements(decoded['measurements_seq'], len(decoded['variables']))
+    if np is not None:
+        column_arrays = arrow_columns_numpy(decoded, columns)
+        arrays = [numpy_to_arrow(np.arange(1, count + 1, dtype=np.int32), pa.int32())]
+    else:
+        column_arrays = arrow_columns_python(decoded, columns)
+        arrays = [pa.array(range(1, count + 1), type=pa.int32())]
+    fields = [pa.field("Measurement #", pa.int32())]
+
+    for column, values in column_arrays:
+        variable, unit = decoded['variables_and_units'][column]
+        arrays.append(values)
+        fields.append(pa.field(decoded['variables'][column], values.type,
+                               metadata={'variable': variable, 'unit': unit}))
+
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def arrow_columns_python(decoded: dict, columns: list[int]):
+    """Yields (column, pyarrow array) for the columns of build_arrow_table."""
+    value_table = decoded['value_table']
+    kinds = value_table['kinds']
+
+    for column, column_indexes in zip(columns, collect_column_indexes(decoded, columns)):
+        distinct = set(column_indexes)
+        distinct.discard(0)
+
+        if all(kinds[index] != VALUE_LABEL for index in distinct):
+            numbers = value_table['values']
+            values = pa.array([numbers[index] for index in column_indexes], type=pa.float64())
+        else:
+            # Dictionary encode: one code per distinct value, null where not measured yet
+            distinct = sorted(distinct)
+            codes = {index: code for code, index in enumerate(distinct)}
+            codes[0] = None
+            values = pa.DictionaryArray.from_arrays(
+                pa.array([codes[index] for index in column_indexes], type=pa.int32()),
+                pa.array([value_table['texts'][index] for index in distinct], type=pa.string()))
+        yield column, values
+
+
+def arrow_columns_numpy(decoded: dict, columns: list[int]):
+    """The same as arrow_columns_python, vectorized with numpy over the measurement matrix."""
+    value_table = decoded['value_table']
+    numbers = np.array(value_table['numbers'], dtype=np.float64)
+    is_label = np.array([kind == VALUE_LABEL for kind in value_table['kinds']], dtype=bool)
+    matrix = decode_measurement_matrix(decoded['measurements_seq'], len(decoded['variables']))
+
+    for column in columns:
+        indexes = np.ascontiguousarray(matrix[:, column])
+        if not is_label.take(indexes).any():
+            # Empty values are NaN in numbers and nulls in the table
+            values = numbers.take(indexes)
+            yield column, numpy_to_arrow(values, pa.float64(), np.isnan(values))
+        else:
+            distinct, codes = np.unique(indexes, return_inverse=True)
+            codes = codes.astype(np.int32)
+            if distinct[0] == 0:
+                # Not measured yet is a null, not a dictionary entry
+                codes -= 1
+                distinct = distinct[1:]
+            yield column, pa.DictionaryArray.from_arrays(
+                numpy_to_arrow(codes, pa.int32(), codes < 0),
+                strings_to_arrow([value_table['texts'][index] for index in distinct.tolist()]))
+
+
+def numpy_to_arrow(values, value_type, null_mask=None):
+    """
+    A pyarrow array over a contiguous numpy array, without copying it. pa.array would do the same,
+    but it imports pandas first, which takes longer than most conversions.
+
+    Args:
+        null_mask: A boolean array, True for the nulls. No nulls when None.
+    """
+    validity = None
+    null_count = 0
+    if null_mask is not None and null_mask.any():
+        validity = pa.py_buffer(np.packbits(~null_mask, bitorder='little'))
+        null_count = int(null_mask.sum())
+    return pa.Array.from_buffers(value_type, len(values), [validity, pa.py_buffer(values)], null_count)
+
+
+def strings_to_arrow(texts: list[str]):
+    """A pyarrow string array, built from its buffers for the same reason as numpy_to_arrow."""
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int32)
+    np.cumsum([len(text) for text in encoded], out=offsets[1:])
+    return pa.Array.from_buffers(pa.string(), len(encoded), [None, pa.py_buffer(offsets), pa.py_buffer(b"".join(encoded))])
+
+
+def collect_column_indexes(decoded: dict, columns: list[int]) -> list[array]:
+    """
+    Collects the raw parameters map indexes column by column, reading only the selected variables.
+
+    Args:
+        decoded: The result of decode_tc_content.
+        columns: Positions of the variables, see select_columns.
+
+    Returns:
+        One array of indexes per column, in the order of columns.
+    """
+    indexes = [array('I') for _ in columns]
+    order = sorted(columns)
+    for row in iter_measurement_indexes(decoded['measurements_seq'][12:], len(decoded['variables']), columns):
+        for position, index in enumerate(row):
+            indexes[position].append(index)
+    return [indexes[order.index(column)] for column in columns]
+
+
+def build_pyramid(decoded: dict, columns: list[int], levels: tuple = PYRAMID_LEVELS) -> dict:
+    """
+    Summarizes every numeric variable in buckets of consecutive measurements, at several resolutions.
+
+    With the pyramid, the min/max/mean of any range of measurements, or a chart of it, take time
+    proportional to the number of buckets instead of the number of measurements (see pyramid_summary
+    and pyramid_series). Variables with labels (e.g. "ON"/"OFF") are left out.
+
+    Args:
+        decoded: The result of decode_tc_content.
+        columns: Positions of the variables to summarize, see select_columns.
+        levels: Bucket sizes, each a multiple of the previous one.
+
+    Returns:
+        A dictionary with 'measurements' (their number), 'levels' (the bucket sizes), 'columns' (the
+        names of all columns, numeric or not, so a reader can check them against the file) and 'variables',
+        which maps each column name to one dictionary per level (in the order of levels) holding
+        'min', 'max', 'mean' and 'count': numpy arrays with numpy, otherwise lists. A bucket without
+        measured values has count 0 and NaN (None in lists) for the rest.
+    """
+    measurement_count = count_measurements(decoded['measurements_seq'], len(decoded['variables']))
+
+    if np is not None:
+        column_levels = pyramid_levels_numpy(decoded, columns, levels)
+    else:
+        column_levels = pyramid_levels_python(decoded, columns, levels)
+
+    variables = {decoded['variables'][column]: pyramid_levels for column, pyramid_levels in column_levels}
+
+    return {
+        'measurements': measurement_count,
+        'levels': list(levels),
+        'columns': [decoded['variables'][column] for column in columns],
+        'variables': variables,
+    }
+
+
+def pyramid_levels_python(decoded: dict, columns: list[int], levels: tuple):
+    """Yields (column, pyramid levels) for the numeric columns, see build_pyramid."""
+    kinds = decoded['value_table']['kinds']
+    numbers = decoded['value_table']['numbers']
+
+    for column, indexes in zip(columns, collect_column_indexes(decoded, columns)):
+        if any(kinds[index] == VALUE_LABEL for index in set(indexes)):
+            continue
+
+        finest = {'min': [], 'max': [], 'mean': [], 'count': []}
+        for start in range(0, len(indexes), levels[0]):
+            # NaN (not measured yet, blank values) is the only value not equal to itself
+            values = [number for number in map(numbers.__getitem__, indexes[start:start + levels[0]]) if number == number]
+            if values:
+                append_bucket(finest, min(values), max(values), sum(values) / len(values), len(values))
+            else:
+                append_bucket(finest, None, None, None, 0)
+
+        pyramid_levels = [finest]
+        for previous_size, size in zip(levels, levels[1:]):
+            previous = pyramid_levels[-1]
+            factor = size // previous_size
+            level = {'min': [], 'max': [], 'mean': [], 'count': []}
+            for first in range(0, len(previous['count']), factor):
+                append_bucket(level, *merge_buckets(previous, first, first + factor))
+            pyramid_levels.append(level)
+        yield column, pyramid_levels
+
+
+def pyramid_levels_numpy(decoded: dict, columns: list[int], levels: tuple):
+    """
+    The same as pyramid_levels_python, vectorized with numpy. The finest level is computed for all
+    columns at once, over blocks of contiguous rows, and every coarser level from the one before it.
+    """
+    value_table = decoded['value_table']
+    numbers = np.array(value_table['numbers'], dtype=np.float64)
+    is_label = np.array([kind == VALUE_LABEL for kind in value_table['kinds']], dtype=bool)
+    matrix = decode_measurement_matrix(decoded['measurements_seq'], len(decoded['variables']))
+    if columns != list(range(matrix.shape[1])):
+        matrix = matrix[:, columns]
+
+    finest = levels[0]
+    block_rows = finest * 256
+    buckets = -(-len(matrix) // finest)
+    has_labels = np.zeros(len(columns), dtype=bool)
+    # (min, max, sum, count) of every level, each with one row of buckets per column
+    finest_level = [np.empty((len(columns), buckets)) for _ in range(3)] + [np.empty((len(columns), buckets), dtype=np.int64)]
+    for first in range(0, len(matrix), block_rows):
+        block = matrix[first:first + block_rows]
+        has_labels |= is_label.take(block).any(axis=0)
+        values = numbers.take(block)
+        if len(values) % finest:
+            values = np.concatenate([values, np.full((-len(values) % finest, len(columns)), np.nan)])
+        # (buckets, measurements, columns), fmin/fmax skip NaN unless the whole bucket is empty
+        values = values.reshape(-1, finest, len(columns))
+        bucket = first // finest
+        minimums, maximums, sums, counts = (statistic[:, bucket:bucket + len(values)].T for statistic in finest_level)
+        np.fmin.reduce(values, axis=1, out=minimums)
+        np.fmax.reduce(values, axis=1, out=maximums)
+        np.nansum(values, axis=1, out=sums)
+        np.sum(~np.isnan(values), axis=1, out=counts)
+    column_levels = [finest_level]
+
+    for previous_size, size in zip(levels, levels[1:]):
+        factor = size // previous_size
+        statistics = []
+        for statistic, empty_value in zip(column_levels[-1], (np.nan, np.nan, np.nan, 0)):
+            missing = -statistic.shape[1] % factor
+            if missing:
+                statistic = np.concatenate([statistic, np.full((len(columns), missing), empty_value,
+                                                               dtype=statistic.dtype)], axis=1)
+            statistics.append(statistic.reshape(len(columns), -1, factor))
+        minimums, maximums, sums, counts = statistics
+        column_levels.append([np.fmin.reduce(minimums, axis=2), np.fmax.reduce(maximums, axis=2),
+                              np.nansum(sums, axis=2), counts.sum(axis=2)])
+
+    for position, column in enumerate(columns):
+        if has_labels[position]:
+            continue
+        pyramid_levels = []
+        for minimums, maximums, sums, counts in column_levels:
+            counts = counts[position].astype(np.int64)
+            empty = counts == 0
+            pyramid_levels.append({'min': minimums[position], 'max': maximums[position],
+                                   'mean': np.where(empty, np.nan, sums[position] / np.where(empty, 1, counts)),
+                                   'count': counts})
+        yield column, pyramid_levels
+
+
+def append_bucket(level: dict, minimum, maximum, mean, count: int) -> None:
+    level['min'].append(minimum)
+    level['max'].append(maximum)
+    level['mean'].append(mean)
+    level['count'].append(count)
+
+
+def merge_buckets(level: dict, first: int, last: int) -> tuple:
+    """Combines the buckets first..last-1 of one pyramid level into (min, max, mean, count)."""
+    counts = level['count'][first:last]
+    total = sum(counts)
+    if total == 0:
+        return None, None, None, 0
+
+    # Empty buckets hold None (NaN in numpy levels), only the count tells them apart
+    minimum = min(value for value, count in zip(level['min'][first:last], counts) if count)
+    maximum = max(value for value, count in zip(level['max'][first:last], counts) if count)
+    mean = sum(mean * count for mean, count in zip(level['mean'][first:last], counts) if count) / total
+    return minimum, maximum, mean, total
+
+
+def recording_name(file_path: str) -> str:
+    """
+    The name of a TC file or of a file converted from it, without the directory and the extension
+    (e.g. "a.b" for a.b.TC, a.b.csv.gz and a.b.changes.csv), so both share the files derived from it.
+    """
+    filename = os.path.basename(file_path)
+    for extension in RECORDING_EXTENSIONS:
+        if filename.lower().endswith(extension) and len(filename) > len(extension):
+            return filename[:-len(extension)]
+    return filename
+
+
+def pyramid_path(output_path: str) -> str:
+    """
+    Where the pyramid of a converted file is stored: next to it, as <output_path>.pyramid.arrow, so
+    conversions of the same recording in other formats or with other variables do not replace it.
+    """
+    return f"{output_path}.pyramid.arrow"
+
+
+def save_pyramid(output_path: str, pyramid: dict) -> str:
+    """Writes the pyramid of a converted file as an Arrow IPC file (see pyramid_to_table), needs pyarrow. Returns its path."""
+    pyramid_filename = pyramid_path(output_path)
+    write_arrow_file(pyramid_filename, pyramid_to_table(pyramid))
+    return pyramid_filename
+
+
+def load_pyramid(output_path: str) -> dict:
+    """
+    Maps the pyramid of a converted file, None when there is none (or pyarrow is not installed).
+    The levels are numpy views of the map, nothing is read until they are used.
+    """
+    if pa is None:
+        return None
+    try:
+        table = pa.ipc.open_file(pa.memory_map(pyramid_path(output_path))).read_all()
+        return pyramid_from_table(table)
+    except (OSError, KeyError, pa.ArrowInvalid):
+        return None
+
+
+def pyramid_to_table(pyramid: dict, metadata: dict = None):
+    """
+    A pyramid as an Arrow table: one column per variable and statistic, holding the levels one after
+    the other. Empty buckets keep NaN instead of nulls, so the columns map without copying.
+    """
+    arrays = []
+    fields = []
+    for variable, levels in pyramid['variables'].items():
+        for statistic in ('min', 'max', 'mean', 'count'):
+            dtype, value_type = (np.int64, pa.int64()) if statistic == 'count' else (np.float64, pa.float64())
+            values = np.concatenate([np.asarray(level[statistic], dtype=dtype) for level in levels])
+            arrays.append(numpy_to_arrow(values, value_type))
+            fields.append(pa.field(f"{statistic} {variable}", arrays[-1].type,
+                                   metadata={'variable': variable, 'statistic': statistic}))
+    schema_metadata = dict(metadata or {}, measurements=str(pyramid['measurements']),
+                           levels=json.dumps(pyramid['levels']), columns=json.dumps(pyramid['columns']))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields, metadata=schema_metadata))
+
+
+def pyramid_from_table(table) -> dict:
+    """The pyramid of a table from pyramid_to_table, its levels are numpy views of the table."""
+    metadata = table.schema.metadata
+    measurements = int(metadata[b'measurements'])
+    levels = json.loads(metadata[b'levels'])
+    # Where each level starts, levels keep an incomplete last bucket
+    offsets = [0]
+    for size in levels:
+        offsets.append(offsets[-1] + -(-measurements // size))
+
+    variables = {}
+    for field, column in zip(table.schema, table.columns):
+        values = column.combine_chunks().to_numpy()
+        variable_levels = variables.setdefault(field.metadata[b'variable'].decode(), [{} for _ in levels])
+        for level, (first, last) in enumerate(zip(offsets, offsets[1:])):
+            variable_levels[level][field.metadata[b'statistic'].decode()] = values[first:last]
+
+    return {'measurements': measurements, 'levels': levels, 'columns': json.loads(metadata[b'columns']),
+            'variables': variables}
+
+
+def pyramid_inner_range(pyramid: dict, start: int, stop: int) -> tuple[int, int]:
+    """
+    The part of the measurements start..stop-1 (counted from 0) made of whole buckets of the finest level,
+    as (first, last + 1). The last bucket of the recording counts as whole when the range reaches the end.
+    Empty (first == last) when the range does not hold a whole bucket.
+    """
+    finest = pyramid['levels'][0]
+    measurements = pyramid['measurements']
+    stop = min(stop, measurements)
+    first = -(-start // finest) * finest
+    last = stop if stop == measurements else stop // finest * finest
+    return (first, last) if first < last else (start, start)
+
+
+def pyramid_edges(pyramid: dict, start: int, stop: int) -> list[tuple[int, int]]:
+    """The (first, last + 1) ranges of start..stop-1 that are not covered by whole buckets, see pyramid_inner_range."""
+    stop = min(stop, pyramid['measurements'])
+    first, last = pyramid_inner_range(pyramid, start, stop)
+    if first == last:
+        return [(start, stop)] if start < stop else []
+    return [(edge_start, edge_stop) for edge_start, edge_stop in ((start, first), (last, stop)) if edge_start < edge_stop]
+
+
+def pyramid_buckets(pyramid: dict, start: int, stop: int) -> list[tuple[int, int]]:
+    """
+    Splits the whole buckets of the measurements start..stop-1 (counted from 0, see pyramid_inner_range)
+    into as few aligned pyramid buckets as possible. The measurements before and after them are
+    returned by pyramid_edges.
+
+    Returns:
+        (level, bucket) pairs, level being the position in pyramid['levels'].
+    """
+    levels = pyramid['levels']
+    finest = levels[0]
+    position, end = pyramid_inner_range(pyramid, start, stop)
+    if position < end == pyramid['measurements']:
+        # The last bucket of the recording may be incomplete
+        end = -(-end // finest) * finest
+
+    buckets = []
+    while position < end:
+        for level in range(len(levels) - 1, -1, -1):
+            size = levels[level]
+            if position % size == 0 and position + size <= end:
+                break
+        buckets.append((level, position // size))
+        position += size
+    return buckets
+
+
+def pyramid_summary(pyramid: dict, variable: str, start: int, stop: int, edge_values) -> dict:
+    """
+    The min, max, mean and count of a variable over the measurements start..stop-1 (counted from 0).
+    The whole buckets come from the pyramid, the few measurements before and after them from edge_values.
+
+    Args:
+        edge_values: The values of the variable in the ranges of pyramid_edges, one after the other
+                     (NaN or None where it was not measured).
+
+    Returns:
+        A dictionary with 'min', 'max', 'mean' and 'count' (None for the rest when count is 0).
+    """
+    levels = pyramid['variables'][variable]
+    merged = {'min': [], 'max': [], 'mean': [], 'count': []}
+    for level, bucket in pyramid_buckets(pyramid, start, stop):
+        data = levels[level]
+        if bucket < len(data['count']):
+            append_bucket(merged, data['min'][bucket], data['max'][bucket], data['mean'][bucket], data['count'][bucket])
+
+    # NaN is the only value not equal to itself
+    values = [value for value in edge_values if value is not None and value == value]
+    if values:
+        append_bucket(merged, min(values), max(values), sum(values) / len(values), len(values))
+
+    minimum, maximum, mean, count = merge_buckets(merged, 0, len(merged['count']))
+    return {'min': minimum, 'max': maximum, 'mean': mean, 'count': count}
+
+
+def pyramid_series(pyramid: dict, variable: str, start: int, stop: int, max_points: int = 1000) -> dict:
+    """
+    A chart of a variable over the measurements start..stop-1, from the finest pyramid level
+    that needs at most max_points buckets (the coarsest level when none does).
+
+    Returns:
+        A dictionary with the lists 'measurement' (first measurement of each bucket, counted from 0),
+        'min', 'max' and 'mean'.
+    """
+    levels = pyramid['levels']
+    level = next((level for level, size in enumerate(levels) if (stop - start) / size <= max_points), len(levels) - 1)
+    size = levels[level]
+    data = pyramid['variables'][variable][level]
+
+    first = start // size
+    last = min(-(-stop // size), len(data['count']))
+    return {
+        'measurement': [bucket * size for bucket in range(first, last)],
+        'min': data['min'][first:last],
+        'max': data['max'][first:last],
+        'mean': data['mean'][first:last],
+    }
+
+
+def tc_to_arrow(tcPath: str, table, output_format: str, output_dir: str = OUTPUT_DIRECTORY) -> str:
+    """
+    Writes a table from build_arrow_table as <output_dir>/<name>.parquet or <output_dir>/<name>.arrow (Arrow IPC file).
+
+    Returns:
+        str: Path of the written file
+    """
+    path, filename = os.path.split(tcPath)
+    base, _ = os.path.splitext(filename)
+    output_filename = f"{output_dir}/{base}.{OUTPUT_FORMATS[output_format][0]}"
+
+    if output_format == 'parquet':
+        with temporary_output(output_filename) as temporary_filename:
+            pq.write_table(table, temporary_filename)
+    else:
+        write_arrow_file(output_filename, table)
+
+    return output_filename
 
 
-def tc_to_csv(csvPath: str, variable_names: list[str], values: list[list[str]]) -> None:
+def write_arrow_file(output_path: str, table) -> None:
+    """Writes a table as an Arrow IPC file, through a temporary file (see temporary_output)."""
+    with temporary_output(output_path) as temporary_filename:
+        with pa.OSFile(temporary_filename, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+
+def tc_to_changes(tcPath: str, variable_names: list[str], changes, value_table: dict, measurement_count: int,
+                  output_dir: str = OUTPUT_DIRECTORY) -> str:
     """
-    Convert measurement data from a TC-like file into a CSV file.
+    Writes the measurements as change events into <output_dir>/<name>.changes.csv.
+
+    Most variables keep their value for many measurements, or are not measured at all for a long
+    time, so only the changes are stored. The file has the columns "Measurement #", "Variable #"
+    and "Value". Measurement 0 describes the table: variable 0 holds the number of measurements,
+    variables 1..n hold the column names. Every other row means that from this measurement on,
+    the variable has the given value ("" when it is not measured). Use load_changes to get the
+    full table back.
+
+    Parameters:
+        tcPath (str): Input filename (e.g. "foo.TC")
+        variable_names (list[str]): Column names, in the order of the variables in changes
+        changes: (measurement, position, index) events, as yielded by iter_changes
+        value_table (dict): The value table from build_value_table
+        measurement_count (int): Number of measurements in the recording
+        output_dir (str): The directory of the written file
+
+    Returns:
+        str: Path of the written file
+    """
+    path, filename = os.path.split(tcPath)
+    base, _ = os.path.splitext(filename)
+    changes_filename = f"{output_dir}/{base}.{OUTPUT_FORMATS['changes'][0]}"
+
+    texts = value_table['texts']
+
+    with temporary_output(changes_filename) as temporary_filename:
+        with open(temporary_filename, mode="w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Measurement #", "Variable #", "Value"])
+            writer.writerow([0, 0, measurement_count])
+            writer.writerows([0, position, name] for position, name in enumerate(variable_names, start=1))
+            writer.writerows([measurement, position + 1, texts[index]] for measurement, position, index in changes)
+
+    return changes_filename
+
+
+def load_changes(changes_path: str) -> tuple[list[str], list[list[str]]]:
+    """
+    Reconstructs the full table from a file written by tc_to_changes.
+
+    Returns:
+        The header (like in the CSV output, starting with "Measurement #") and the measurements
+        as lists of value strings, like process_measurements returns them.
+    """
+    with open(changes_path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader)  # column names of the change events
+
+        variable_names = []
+        measurement_count = 0
+        rows = []
+        current = None
+
+        for measurement, variable, value in reader:
+            measurement = int(measurement)
+            variable = int(variable)
+
+            if measurement == 0:
+                if variable == 0:
+                    measurement_count = int(value)
+                else:
+                    variable_names.append(value)
+                continue
+
+            if current is None:
+                current = [""] * len(variable_names)
+            # Repeat the last known values up to the measurement of this change
+            while len(rows) < measurement - 1:
+                rows.append(list(current))
+            current[variable - 1] = value
+
+        if current is None:
+            current = [""] * len(variable_names)
+        while len(rows) < measurement_count:
+            rows.append(list(current))
+
+    return ["Measurement #"] + variable_names, rows
+
+
+def tc_to_csv(csvPath: str, variable_names: list[str], values, texts: list[str] = None,
+              output_dir: str = OUTPUT_DIRECTORY, compression: str = None) -> str:
+    """
+    Convert measurement data from a TC-like file into a CSV file: <output_dir>/<name>.csv, with .gz or .zst
+    added when compressed. The file is written under a temporary name and renamed when complete, so a
+    reader never sees half of it.
+
+    With texts, values are rows of parameters map indexes (e.g. from iter_measurement_indexes) and every
+    distinct value is rendered as a CSV field only once, then the rows are joined and written in batches
+    of CSV_BATCH_ROWS. The file is the same as the one csv.writer writes.
 
     Parameters:
         filename (str): Input filename (e.g. "foo.TC")
         variable_names (list[str]): List of variable names for the CSV header
-        values (list[list[str]]): 2D list of measurements (rows of values)
+        values: Rows of parameters map indexes when texts is given, otherwise rows of value strings
+        texts (list[str]): The value strings by parameters map index, see build_value_table
+        output_dir (str): The directory of the written file
+        compression (str): One of CSV_COMPRESSIONS, None to not compress
+
+    Returns:
+        str: Path of the written CSV file
     """
     # Derive CSV filename
     path, filename = os.path.split(csvPath)
     base, _ = os.path.splitext(filename)
-    csv_filename = f"output/{base}.csv"
+    csv_filename = f"{output_dir}/{base}.csv" + (CSV_COMPRESSIONS[compression] if compression else "")
 
     # Create header row: Measurement number + variable names
     header = ["Measurement #"] + variable_names
 
     # Write CSV
-    with open(csv_filename, mode="w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(header)
+    with temporary_output(csv_filename) as temporary_filename:
+        with open_csv_output(temporary_filename, compression) as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+
+            if texts is None:
+                # Write measurements with numbering
+                writer.writerows((i, *row) for i, row in enumerate(values, start=1))
+            else:
+                # Every field with the comma before it, so a row is its number followed by its fields
+                fields = [f",{field}" for field in render_csv_fields(texts)]
+                get_field = fields.__getitem__
+                rows = iter(values)
+                number = 1
+                while batch := list(islice(rows, CSV_BATCH_ROWS)):
+                    f.write("".join([f"{i}{''.join(map(get_field, row))}\r\n"
+                                     for i, row in enumerate(batch, start=number)]))
+                    number += len(batch)
+
+    return csv_filename
+
+
+def render_csv_fields(texts: list[str]) -> list[str]:
+    """Renders each string as csv.writer writes it as a field (quoted and escaped when needed)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    fields = []
+    for text in texts:
+        buffer.seek(0)
+        buffer.truncate()
+        # A second field, so an empty string is not quoted like an empty row would be
+        writer.writerow((text, ""))
+        fields.append(buffer.getvalue()[:-3])
+    return fields
+
+
+def open_csv_output(file_path: str, compression: str = None):
+    """Opens a CSV file for writing as text, gzip or zstd compressed when asked to."""
+    if compression == 'gzip':
+        # Level 6 is the zlib default, the gzip default (9) is several times slower for a few percent
+        return gzip.open(file_path, mode="wt", newline="", encoding="utf-8", compresslevel=6)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("The zstd compression requires zstandard (pip install zstandard).")
+        stream = zstandard.ZstdCompressor().stream_writer(open(file_path, 'wb'))
+        return io.TextIOWrapper(stream, newline="", encoding="utf-8")
+    return open(file_path, mode="w", newline="", encoding="utf-8")
+
+
+@contextmanager
+def temporary_output(output_path: str):
+    """
+    Yields a temporary path next to output_path, renamed to output_path when the block completes.
+    When the block fails, the temporary file is removed and an older output_path is left as it was.
+    """
+    temporary_path = f"{output_path}.tmp{os.getpid()}"
+    try:
+        yield temporary_path
+        os.replace(temporary_path, output_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+def process_measurements(parameters_map: list, measurements_seq: bytes, number_of_variables: int, value_table: dict = None):
+    return list(iter_measurement_values(parameters_map, measurements_seq, number_of_variables, value_table))
 
-        # Write measurements with numbering
-        for i, row in enumerate(values, start=1):
-            writer.writerow([i] + row)
 
-    print(f"✅ CSV file saved as: {csv_filename}")
+def iter_measurement_values(parameters_map: list, measurements_seq: bytes, number_of_variables: int,
+                            value_table: dict = None, columns: list[int] = None):
+    """
+    Yields the measurements one at a time, as lists of value strings ("" when not measured yet).
 
-def process_measurements(parameters_map: list, measurements_seq: bytes, number_of_variables: int):
+    Args:
+        columns: Positions of the variables to yield, in this order. All variables when None.
+    """
     number1 = numbers_from_bytes(measurements_seq, 0) # Always 0
     number2 = numbers_from_bytes(measurements_seq, 1) # no idea. Checksum???
     number3 = numbers_from_bytes(measurements_seq, 2) # number_of_variables * 4. So how many bites we should take at one time.
 
-    assert(number3 == number_of_variables * 4)
+    check_row_size(number3, number_of_variables)
 
-    measurements_seq = measurements_seq[12:]
+    if value_table is None:
+        value_table = build_value_table(parameters_map)
+    # measurement_seq contains indexes into parameters_map, counted from 1. The value table
+    # is indexed the same way, with the "not measured yet" value at index 0.
+    lookup = value_table['texts']
 
-    all_measurements = []
-    i = 0
-    first = True
-
-    # Iterates over whole measurement seq
-    while 0 < len(measurements_seq):
-        # Iterates over each variable in current measurement.
-        values = []
-        for i in range(number_of_variables):
-            # measurement_seq contains indexes into parameters_map. We are taking the index, and moving it to index from 0.
-            index = numbers_from_bytes(measurements_seq, i) - 1
-            # Not all variables are measured from the start. If measurement is missing, index is set to -1.
-            if index == -1:
-                values.append("")
-            else:
-                values.append(parameters_map[index])
-        all_measurements.append(values)
-        first = False
-        # remove the currently processed indexes
-        measurements_seq = measurements_seq[4 * number_of_variables:]
+    if columns is None or columns == sorted(columns):
+        for indexes in iter_measurement_indexes(measurements_seq[12:], number_of_variables, columns):
+            yield [lookup[index] for index in indexes]
+    else:
+        # The indexes come in file order, put them in the requested order
+        order = sorted(columns)
+        positions = [order.index(column) for column in columns]
+        for indexes in iter_measurement_indexes(measurements_seq[12:], number_of_variables, columns):
+            yield [lookup[indexes[position]] for position in positions]
+
+
+def check_row_size(row_size: int, number_of_variables: int) -> None:
+    """Checks the measurement size declared by the MeasurementsSeq section (its third number) against the variables."""
+    if row_size != number_of_variables * 4:
+        raise TcFormatError(f"Measurements of {row_size} bytes do not match {number_of_variables} variables "
+                            f"({number_of_variables * 4} bytes)", 8, 'MeasurementsSeq')
+
+
+def iter_measurement_indexes(data, number_of_variables: int, columns: list[int] = None):
+    """
+    Yields the raw parameters_map indexes of the measurement sequence, one tuple per measurement.
+
+    The data is read once through a memoryview, so no part of it is copied or re-sliced
+    while iterating. An incomplete last measurement is padded with zeroes (missing values),
+    the same way the original byte-by-byte decoding treated it.
+
+    Args:
+        data: The measurement sequence without its 12 byte header.
+        number_of_variables: How many indexes make up one measurement.
+        columns: Only unpack the indexes of these variables. The tuples hold them in file order
+                 (sorted by column), the other indexes are skipped without being read.
+    """
+    if number_of_variables <= 0:
+        return
+
+    row_format = measurement_row_format(number_of_variables, columns)
+    view = memoryview(data).cast('B')
+    complete_length = len(view) - len(view) % row_format.size
+
+    yield from row_format.iter_unpack(view[:complete_length])
+
+    if complete_length < len(view):
+        tail = bytes(view[complete_length:])
+        yield row_format.unpack(tail + bytes(row_format.size - len(tail)))
 
-    return all_measurements
+
+def iter_changes(measurements_seq: bytes, number_of_variables: int, columns: list[int] = None):
+    """
+    Yields only the cells of the measurement sequence that differ from the previous measurement.
+
+    Works on the raw indexes, so no value is looked up for the unchanged cells. Before the first
+    measurement, all variables count as not measured (index 0).
+
+    Args:
+        columns: Only these variables, see select_columns. All when None.
+
+    Yields:
+        (measurement, position, index) tuples: the measurement number counted from 1, the position
+        of the variable in columns (or among all variables), and its new parameters map index
+        (0 when it is not measured any more).
+    """
+    if columns is None:
+        columns = list(range(number_of_variables))
+    # The indexes come in file order, map them back to the requested positions
+    order = sorted(columns)
+    positions = [columns.index(column) for column in order]
+
+    previous = (0,) * len(order)
+    for measurement, indexes in enumerate(iter_measurement_indexes(measurements_seq[12:], number_of_variables, columns), start=1):
+        if indexes != previous:
+            for position, index, previous_index in zip(positions, indexes, previous):
+                if index != previous_index:
+                    yield measurement, position, index
+            previous = indexes
+
+
+def count_measurements(measurements_seq: bytes, number_of_variables: int) -> int:
+    """Number of measurements in the sequence, counting an incomplete last one."""
+    if number_of_variables <= 0:
+        return 0
+    return -(-(len(measurements_seq) - 12) // (number_of_variables * 4))
+
+
+def measurement_row_format(number_of_variables: int, columns: list[int] = None) -> struct.Struct:
+    """
+    Builds the struct format of one measurement: a 4 byte little endian index per variable.
+    Variables that are not in columns become pad bytes, which struct skips without decoding.
+    """
+    if columns is None:
+        return struct.Struct(f"<{number_of_variables}I")
+
+    parts = []
+    position = 0
+    for column in sorted(set(columns)):
+        if column > position:
+            parts.append(f"{4 * (column - position)}x")
+        parts.append("I")
+        position = column + 1
+    if position < number_of_variables:
+        parts.append(f"{4 * (number_of_variables - position)}x")
+
+    return struct.Struct("<" + "".join(parts))
+
+
+def decode_measurement_matrix(measurements_seq: bytes, number_of_variables: int):
+    """
+    Reads the measurement sequence as a numpy matrix of raw parameters_map indexes.
+
+    The matrix is a view of the section data (no copy), with shape (measurements, number_of_variables).
+    Index 0 means the variable was not measured yet, any other index points to parameters_map[index - 1].
+    An incomplete last measurement is padded with zeroes, like in process_measurements.
+    """
+    if np is None:
+        raise ImportError("The columnar decode engine requires numpy (pip install numpy).")
+
+    number3 = numbers_from_bytes(measurements_seq, 2) # number_of_variables * 4
+    check_row_size(number3, number_of_variables)
+
+    data = memoryview(measurements_seq).cast('B')[12:]
+    row_size = number_of_variables * 4
+    if row_size == 0:
+        return np.zeros((0, 0), dtype='<u4')
+
+    missing = -len(data) % row_size
+    if missing:
+        data = bytes(data) + bytes(missing)
+
+    return np.frombuffer(data, dtype='<u4').reshape(-1, number_of_variables)
+
+
+def decode_columns(parameters_map: list, measurements_seq: bytes, variable_names: list[str], value_table: dict = None,
+                   columns: list[int] = None) -> dict:
+    """
+    Decodes the measurement sequence into typed columns, one per variable.
+
+    Args:
+        parameters_map: The string table from process_parameters_map.
+        measurements_seq: The raw MeasurementsSeq section.
+        variable_names: Column names, as returned by variables_and_units_to_string.
+        value_table: The parsed parameters map from build_value_table. Built when not given.
+        columns: Only decode the variables at these positions (see select_columns). All when None.
+
+    Returns:
+        A dictionary mapping each variable name to its column. Columns whose measured values are all
+        numeric are float64 numpy arrays, with NaN where the variable was not measured yet (or is blank).
+        Other columns (e.g. "ON"/"OFF") are (codes, categories) tuples, where codes is an int32 array
+        indexing into the categories list and -1 marks a missing value.
+    """
+    matrix = decode_measurement_matrix(measurements_seq, len(variable_names))
+
+    if value_table is None:
+        value_table = build_value_table(parameters_map)
+    numbers = np.array(value_table['numbers'], dtype=np.float64)
+    is_numeric = np.array([kind != VALUE_LABEL for kind in value_table['kinds']], dtype=bool)
+
+    if columns is None:
+        columns = range(len(variable_names))
+
+    decoded_columns = {}
+    for column in columns:
+        name = variable_names[column]
+        indexes = np.ascontiguousarray(matrix[:, column])
+        if is_numeric.take(indexes).all():
+            decoded_columns[name] = numbers.take(indexes)
+        else:
+            distinct, codes = np.unique(indexes, return_inverse=True)
+            codes = codes.astype(np.int32)
+            if distinct[0] == 0:
+                # Shift codes so that "not measured yet" becomes -1
+                codes -= 1
+                distinct = distinct[1:]
+            decoded_columns[name] = (codes, [parameters_map[index - 1] for index in distinct])
+
+    return decoded_columns
+
+
+def build_value_table(parameters_map: list) -> dict:
+    """
+    Classifies and converts every distinct value of the parameters map once.
+
+    Measurements only point into the parameters map, so converting its entries is enough to type
+    every cell of the recording. All lists are indexed like the measurement sequence: index 0 is the
+    "not measured yet" value, index i is parameters_map[i - 1].
+
+    Returns:
+        A dictionary with the parallel lists:
+        'texts': the original strings, as written to the CSV ("" for not measured yet),
+        'kinds': VALUE_EMPTY, VALUE_INT, VALUE_FLOAT or VALUE_LABEL,
+        'values': the converted value (int, float, the label string, or None when empty),
+        'numbers': the value as float, NaN for empty values and labels.
+    """
+    texts = [""]
+    kinds = [VALUE_EMPTY]
+    values = [None]
+    numbers = [float("nan")]
+
+    for text in parameters_map:
+        stripped = text.strip()
+        if not stripped:
+            kind, value, number = VALUE_EMPTY, None, float("nan")
+        elif INT_PATTERN.fullmatch(stripped):
+            value = int(stripped)
+            kind, number = VALUE_INT, float(value)
+        elif FLOAT_PATTERN.fullmatch(stripped):
+            value = float(stripped)
+            kind, number = VALUE_FLOAT, value
+        else:
+            kind, value, number = VALUE_LABEL, text, float("nan")
+
+        texts.append(text)
+        kinds.append(kind)
+        values.append(value)
+        numbers.append(number)
+
+    return {
+        'texts': texts,
+        'kinds': kinds,
+        'values': values,
+        'numbers': numbers,
+    }
+
+
+def variables_and_units_to_pairs(parameters_map: list, variables_and_units: list) -> list[tuple[str, str]]:
+    """
+    Like variables_and_units_to_string, but returns (variable name, unit name) pairs.
+    """
+    half_length = len(variables_and_units) // 2
+    variable_indexes = variables_and_units[:half_length]
+    unit_indexes = variables_and_units[half_length:]
+
+    return [(parameters_map[item - 1], parameters_map[unit_indexes[index] - 1])
+            for index, item in enumerate(variable_indexes)]
 
 
 def variables_and_units_to_string(parameters_map: list, variables_and_units: list):
@@ -135,77 +1572,107 @@ def variables_and_units_to_string(parameters_map: list, variables_and_units: lis
 
 
 def process_variables_units(data: bytes):
+    """
+    Reads the parameters map indexes of the variable names and units. Each index is a 16 bit number
+    written twice, the list ends with a zero.
+
+    Raises:
+        TcFormatError: When the two copies of an index differ, or the list is not terminated.
+    """
     number1 = numbers_from_bytes(data, 0) # no idea.
     number2 = numbers_from_bytes(data, 1) # no idea. Checksum???
     number3 = numbers_from_bytes(data, 2) # length of the data (without the first 3 number). With zeroes et the end. This will NOT be equal to length of the resulting array.
 
     data = data[12:] # removing first 3 numbers
 
-    #resulting array of numbers
-    numbers = []
-
-    i = 0
-
-    while i < len(data):
-        # 1. Extract the current 4-byte chunk
-        chunk = data[i:i + 4]  # e.g., b'\x0A\x00\x0A\x00'
-
-        # 2. Split the chunk into the number and its required repetition
-        number_bytes = chunk[0:2]  # First two bytes (the number)
-        repeated_bytes = chunk[2:4]  # Second two bytes (the repetition)
+    # All 16 bit halves at once: numbers at the even positions, their repetitions at the odd ones
+    halves = array('H')
+    halves.frombytes(data[:len(data) // 4 * 4])
+    if sys.byteorder == "big":
+        halves.byteswap()
+    numbers = halves[0::2]
+    repeated = halves[1::2]
 
-        # 3. Assert that the second two bytes are the same as the first two
-        # If this assert fails, the program will halt with an AssertionError.
-        assert number_bytes == repeated_bytes, \
-            (f"Validation failed at index {i}. Expected repetition of {number_bytes.hex()}, "
-             f"but found {repeated_bytes.hex()}.")
-
-        # 4. Convert the 2-byte segment to an integer (little-endian)
-        # byteorder='little' means the least significant byte (LSB) is first.
-        number = int.from_bytes(number_bytes, byteorder='little')
-
-        if number == 0:
-            break
-
-        # 5. Store the number
-        numbers.append(number)
+    try:
+        count = numbers.index(0)
+    except ValueError:
+        count = len(numbers)
+        if len(data) % 4:
+            raise TcFormatError("The list of variables and units is not terminated", len(data) // 4 * 4 + 12,
+                                'VariablesAndUnitsSeq')
 
-        # 6. Advance the index by 4 bytes
-        i += 4
+    # The terminating zero is repeated as well
+    checked = min(count + 1, len(numbers))
+    if numbers[:checked] != repeated[:checked]:
+        position = next(i for i in range(checked) if numbers[i] != repeated[i])
+        raise TcFormatError(f"Index {numbers[position]} is repeated as {repeated[position]}", position * 4 + 12,
+                            'VariablesAndUnitsSeq')
 
-    return numbers
+    return numbers[:count].tolist()
 
 def process_parameters_map(data: bytes):
+    """
+    Reads the string table. Each string is stored as a length byte (counting itself), a zero byte,
+    the ascii characters and a closing zero byte.
+
+    Raises:
+        TcFormatError: When a string is cut off, not framed by zero bytes or not ascii, or when the
+                       number of strings does not match the one declared by the section.
+    """
     number1 = numbers_from_bytes(data, 0) # always 0
     number2 = numbers_from_bytes(data, 1) # no idea. Checksum???
     number3 = numbers_from_bytes(data, 2) # length of the resulting array
     data = data[12:] # removing first 3 numbers
 
-    i = 0
-    #resulting array of strings
-    strings = []
+    # One decode of the whole table. latin-1 maps every byte to one character, so the offsets stay the same.
+    text = str(data, 'latin-1')
 
-    while i < len(data):
-        # first byte is length of the next bytes, we should take into consideration.
-        string_length = data[i]
-        i += 1
+    # Splitting on the zero bytes gives the length bytes at the even positions and the strings at the odd ones
+    parts = text.split("\0")
+    strings = parts[1::2]
+    if not parameters_map_is_framed(parts, strings):
+        # A zero byte inside a string, or a broken table: read the strings one by one
+        strings = walk_parameters_map(text)
 
-        # Calculate the slice boundaries
-        start_of_string = i
-        end_of_string = i + string_length - 1
+    if not "".join(strings).isascii():
+        position = next(i for i, string in enumerate(strings) if not string.isascii())
+        offset = sum(len(string) + 3 for string in strings[:position])
+        raise TcFormatError("String is not ascii", offset + 12, 'ParametersMap')
+    if number3 != len(strings):
+        raise TcFormatError(f"The table declares {number3} strings, but holds {len(strings)}", 8, 'ParametersMap')
+
+    return strings
+
+
+def parameters_map_is_framed(parts: list[str], strings: list[str]) -> bool:
+    """Checks that the split of process_parameters_map found every string where its length byte says it is."""
+    lengths = parts[0:-1:2]
+    if len(parts) % 2 == 0 or parts[-1] != "" or list(map(len, lengths)) != [1] * len(lengths):
+        return False
+    try:
+        # The length byte counts itself, the two zero bytes and the characters
+        return "".join(lengths).encode('latin-1') == bytes(map((3).__add__, map(len, strings)))
+    except ValueError:
+        # A string longer than a length byte can describe
+        return False
 
-        # The first and last bytes should be always 0. omitting.
-        assert(data[start_of_string] == 0)
-        assert(data[end_of_string - 1] == 0)
-        string_bytes = data[start_of_string + 1:end_of_string - 1]
 
-        #Transforming bytes to ascii
-        strings.append(string_bytes.decode('ascii'))
+def walk_parameters_map(text: str) -> list[str]:
+    """Reads the strings of the table one by one, following their length bytes."""
+    strings = []
+    i = 0
+    while i < len(text):
+        # first byte is length of the next bytes, we should take into consideration.
+        string_length = ord(text[i])
+        if string_length < 3 or i + string_length > len(text):
+            raise TcFormatError(f"String of length {string_length} does not fit", i + 12, 'ParametersMap')
 
-        # ... (decoding and index update)
-        i = end_of_string
+        # The first and last bytes should be always 0. omitting.
+        if text[i + 1] != "\0" or text[i + string_length - 1] != "\0":
+            raise TcFormatError("String is not framed by zero bytes", i + 12, 'ParametersMap')
+        strings.append(text[i + 2:i + string_length - 1])
+        i += string_length
 
-    assert(number3 == len(strings))
     return strings
 
 
@@ -214,94 +1681,320 @@ def numbers_from_bytes(data: bytes, index = 0):
 
 def print_hex(data: bytes):
     print(data.hex(' '))
+
+
+# Define the separators as bytes
+SEP_PARAMETERS_MAP = b'\x00\x00\x10\x00\x02\x00'  # Separator for ParametersMap start
+SEP_MEASUREMENTS_SEQ = b'\x00\x00\x10\x00\x04\x00'  # Separator for MeasurementsSeq start
+SEP_VARIABLES_UNITS_SEQ = b'\x00\x00\x10\x00\x05\x00'  # Separator for VariablesAndUnitsSeq start
+
+# Every section starts with a 4 byte marker "10 00 <kind> 00" (the separators above without their
+# first two zero bytes, which belong to the end of the previous part). Then come 3 numbers: the offset
+# of the next marker (not always filled in), the length of the data after the numbers, and a count.
+SECTION_MARKER = struct.Struct("<HH")
+SECTION_HEADER = struct.Struct("<III")
+SECTION_NAMES = {
+    5: 'VariablesAndUnitsSeq',
+    4: 'MeasurementsSeq',
+    2: 'ParametersMap',
+}
+
+
+def scan_sections(binary_data) -> dict:
+    """
+    Finds the sections of a TC file in a single forward pass over their framing.
+
+    Only the header before the first section is searched. From there on, the declared length of each
+    section leads directly to the marker of the next one, so the measurements are never scanned, and a
+    separator-like byte pattern inside them can not split the file at the wrong place.
+
+    Args:
+        binary_data: The TC file, as bytes or a mapped file.
+
+    Returns:
+        A dictionary mapping 'VariablesAndUnitsSeq', 'MeasurementsSeq' and 'ParametersMap' to the
+        (start, end) offsets of their data, starting with the 3 numbers after the marker (the same
+        part decode_binary_data returns).
+
+    Raises:
+        TcFormatError: When the framing does not add up.
+    """
+    marker = binary_data.find(SEP_VARIABLES_UNITS_SEQ)
+    if marker == -1:
+        raise TcFormatError("No section marker", 0)
+    marker += 2
+    file_length = len(binary_data)
+    sections = {}
+
+    while marker < file_length:
+        if marker + SECTION_MARKER.size + SECTION_HEADER.size > file_length:
+            raise TcFormatError("Section header is cut off", marker)
+
+        tag, kind = SECTION_MARKER.unpack_from(binary_data, marker)
+        if tag != 0x10 or kind not in SECTION_NAMES:
+            raise TcFormatError("No section marker", marker)
+        name = SECTION_NAMES[kind]
+        if name in sections:
+            raise TcFormatError(f"Section {name} found twice", marker)
+
+        start = marker + SECTION_MARKER.size
+        next_offset, length, count = SECTION_HEADER.unpack_from(binary_data, start)
+        end = start + SECTION_HEADER.size + length
+        if end > file_length:
+            raise TcFormatError(f"Section {name} is longer than the file", marker)
+
+        sections[name] = (start, end)
+        marker = end
+
+    missing = [name for name in SECTION_NAMES.values() if name not in sections]
+    if missing:
+        raise TcFormatError(f"Sections not found: {', '.join(missing)}", marker)
+
+    return sections
+
+
 def decode_binary_data(binary_data: bytes) -> dict:
     """
-    Decodes binary data by splitting it into three sections based on separators.
+    Decodes binary data by splitting it into its three sections, found by scan_sections.
 
     Args:
-        binary_data: The input binary data as a bytes object.
+        binary_data: The input binary data as a bytes object, or a mapped file from open_tc_file.
 
     Returns:
         A dictionary containing the three extracted binary data sections:
         'ParametersMap', 'MeasurementsSeq', and 'VariablesAndUnitsSeq'.
-        The values are bytes objects.
+        The values are memoryviews into binary_data, nothing is copied.
+
+    Raises:
+        TcFormatError: When there are no sections, or their framing does not add up.
     """
-    # Define the separators as bytes
-    SEP_PARAMETERS_MAP = b'\x00\x00\x10\x00\x02\x00'  # Separator for ParametersMap start
-    SEP_MEASUREMENTS_SEQ = b'\x00\x00\x10\x00\x04\x00'  # Separator for MeasurementsSeq start
-    SEP_VARIABLES_UNITS_SEQ = b'\x00\x00\x10\x00\x05\x00'  # Separator for VariablesAndUnitsSeq start
+    sections = scan_sections(binary_data)
+
+    view = memoryview(binary_data)
+    return {name: view[start:end] for name, (start, end) in sections.items()}
+
+
+def follow_tc_file(file_path: str, on_measurements, variables: list[str] = None, interval: float = 0.2,
+                   idle_timeout: float = None) -> int:
+    """
+    Decodes a TC file while it is still being recorded, passing on only the new measurements.
+
+    The file is polled every interval seconds. When it changed, its sections are scanned again and
+    only the complete measurements after the last one passed on are decoded. The string table is
+    parsed again only when it grew. Measurements that point to values that are not written yet are
+    kept for the next poll.
+
+    Args:
+        on_measurements: Called as on_measurements(header, first_number, rows) for every batch of new
+                         measurements, where header are the column names, first_number the
+                         measurement number of the first row (counted from 1) and rows lists of values.
+        variables: Only pass on these variables, see select_columns. All variables when None.
+        interval: Seconds between two polls.
+        idle_timeout: Stop when the file did not grow for this many seconds. Follow forever when None.
+
+    Returns:
+        The number of measurements passed on. Stops on KeyboardInterrupt.
+
+    Raises:
+        FileNotFoundError: When the file does not exist when following starts.
+        ValueError: When a selected variable is not in the file (see select_columns).
+    """
+    state = {'measurements': 0, 'table_key': None, 'value_table': None, 'columns': None}
+    last_stat = None
+    # Only a file that disappears later is waited for
+    os.stat(file_path)
+    last_growth = time.monotonic()
 
-    # --- 1. Extract ParametersMap ---
-    # From SEP_PARAMETERS_MAP till the end of the file
-    try:
-        start_parameters_map = binary_data.index(SEP_PARAMETERS_MAP)
-        # + len(SEP_PARAMETERS_MAP) is optional here, as the prompt says "from" the separator
-        # but usually it's better to exclude the separator itself. We'll include it for safety
-        # based on the prompt's literal phrasing 'from the separator... till the end'.
-        # However, for structured data splitting, typically the *data* starts *after* the marker.
-        # Let's assume the data *starts* after the separator for cleaner sectioning.
-        start_parameters_map_data = start_parameters_map + len(SEP_PARAMETERS_MAP)
-        ParametersMap = binary_data[start_parameters_map_data:]
-    except ValueError:
-        print("Parameters map separator not found")
-        # Separator not found
-        ParametersMap = b''
-        start_parameters_map = -1
-        # It's important to find this position for the next split
-        start_parameters_map_data = -1  # Sentinel value if not found
-
-    # We need to know where the SEP_PARAMETERS_MAP was found for the next step's *end* position.
-    # We use the position *where* the separator was found (not the data start)
-    end_measurements_seq = start_parameters_map
-
-    # --- 2. Extract MeasurementsSeq ---
-    # From SEP_MEASUREMENTS_SEQ till SEP_PARAMETERS_MAP
     try:
-        # Find the start of MeasurementsSeq
-        start_measurements_seq = binary_data.index(SEP_MEASUREMENTS_SEQ)
-
-        # Calculate the end position. If SEP_PARAMETERS_MAP wasn't found (end_measurements_seq == -1),
-        # we can't reliably determine the end, but since it's the *last* one specified,
-        # the entire rest of the file *might* be it. But based on the structure, we need the start position.
-        if start_measurements_seq != -1 and end_measurements_seq != -1:
-            # Data starts after its own separator
-            start_measurements_seq_data = start_measurements_seq + len(SEP_MEASUREMENTS_SEQ)
-            MeasurementsSeq = binary_data[start_measurements_seq_data:end_measurements_seq]
-        else:
-            MeasurementsSeq = b''
-    except ValueError:
-        print("Measurements separator not found")
-        # Separator not found
-        MeasurementsSeq = b''
-        start_measurements_seq = -1
+        while True:
+            try:
+                stat = os.stat(file_path)
+                stat_key = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                stat_key = None
+
+            if stat_key is not None and stat_key != last_stat:
+                last_stat = stat_key
+                try:
+                    with open_tc_file(file_path) as content:
+                        header, first_number, rows = decode_new_measurements(content, state, variables)
+                except TcFormatError:
+                    # The file is in the middle of being written, try again on the next poll
+                    rows = []
+                if rows:
+                    on_measurements(header, first_number, rows)
+                    last_growth = time.monotonic()
+
+            if idle_timeout is not None and time.monotonic() - last_growth > idle_timeout:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+    return state['measurements']
+
+
+def decode_new_measurements(content, state: dict, variables: list[str] = None) -> tuple[list[str], int, list]:
+    """
+    Decodes the measurements of content that follow_tc_file did not pass on yet, and updates its state.
+
+    Returns:
+        The column names, the number of the first new measurement and the new measurements.
+    """
+    sections = scan_sections(content)
+    view = memoryview(content)
+
+    variables_and_units_start, variables_and_units_end = sections['VariablesAndUnitsSeq']
+    parameters_start, parameters_end = sections['ParametersMap']
+    measurements_start, measurements_end = sections['MeasurementsSeq']
+
+    # The string table only grows, so it is parsed again only when its header changed
+    table_key = bytes(view[parameters_start:parameters_start + 12])
+    if table_key != state['table_key']:
+        parameters_map = process_parameters_map(view[parameters_start:parameters_end])
+        state['parameters_map'] = parameters_map
+        state['value_table'] = build_value_table(parameters_map)
+        state['table_key'] = table_key
+
+    parameters_map = state['parameters_map']
+    # The variables do not change while recording, so they are selected once
+    if state['columns'] is None:
+        variables_and_units = process_variables_units(view[variables_and_units_start:variables_and_units_end])
+        variable_names = variables_and_units_to_string(parameters_map, variables_and_units)
+        state['columns'] = select_columns(variable_names, variables)
+        state['header'] = [variable_names[column] for column in state['columns']]
+        state['variable_count'] = len(variable_names)
+    columns = state['columns']
+    header = state['header']
+    variable_count = state['variable_count']
+
+    # Only complete measurements, the last one may still be being written
+    row_size = variable_count * 4
+    available = (measurements_end - measurements_start - 12) // row_size if row_size else 0
+    done = state['measurements']
+    if available <= done:
+        return header, done + 1, []
+
+    texts = state['value_table']['texts']
+    data = view[measurements_start + 12 + done * row_size:measurements_start + 12 + available * row_size]
+    order = sorted(columns)
+    positions = [order.index(column) for column in columns]
+
+    rows = []
+    for indexes in iter_measurement_indexes(data, variable_count, columns):
+        if max(indexes, default=0) >= len(texts):
+            # Points to a value that is not in the string table yet
+            break
+        rows.append([texts[indexes[position]] for position in positions])
+
+    state['measurements'] = done + len(rows)
+    return header, done + 1, rows
+
+
+def follow_to_csv(file_path: str, output_path: str = None, variables: list[str] = None, interval: float = 0.2,
+                  idle_timeout: float = None, output_dir: str = OUTPUT_DIRECTORY) -> int:
+    """
+    Follows a TC file that is being recorded (see follow_tc_file) and appends the new measurements
+    to a CSV file as they arrive.
+
+    Args:
+        output_path: The CSV file, "-" for the standard output. Defaults to <output_dir>/<name>.csv.
+        output_dir: The directory of the default output (created when missing).
 
-    # We need to know where the SEP_MEASUREMENTS_SEQ was found for the next step's *end* position.
-    # We use the position *where* the separator was found
-    end_variables_units_seq = start_measurements_seq
+    Returns:
+        The number of measurements written.
+
+    Raises:
+        The errors of follow_tc_file, before the output is created.
+    """
+    if output_path is None:
+        path, filename = os.path.split(file_path)
+        base, _ = os.path.splitext(filename)
+        output_path = f"{output_dir}/{base}.csv"
 
-    # --- 3. Extract VariablesAndUnitsSeq ---
-    # From SEP_VARIABLES_UNITS_SEQ to SEP_MEASUREMENTS_SEQ
+    # Opened with the first measurements, so an error of follow_tc_file leaves an existing output untouched
+    output = {}
     try:
-        # Find the start of VariablesAndUnitsSeq
-        start_variables_units_seq = binary_data.index(SEP_VARIABLES_UNITS_SEQ)
-        # Calculate the end position.
-        if start_variables_units_seq != -1 and end_variables_units_seq != -1:
-            # Data starts after its own separator
-            start_variables_units_seq_data = start_variables_units_seq + len(SEP_VARIABLES_UNITS_SEQ)
-            VariablesAndUnitsSeq = binary_data[start_variables_units_seq_data:end_variables_units_seq]
-        else:
-            VariablesAndUnitsSeq = b''
-    except ValueError:
-        print("Variables and units separator not found")
-        # Separator not found
-        VariablesAndUnitsSeq = b''
+        def write_measurements(header: list[str], first_number: int, rows: list[list[str]]):
+            if not output:
+                if output_path == "-":
+                    output['file'] = sys.stdout
+                else:
+                    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+                    output['file'] = open(output_path, mode="w", newline="", encoding="utf-8")
+                output['writer'] = csv.writer(output['file'])
+            if first_number == 1:
+                output['writer'].writerow(["Measurement #"] + header)
+            output['writer'].writerows([number] + row for number, row in enumerate(rows, start=first_number))
+            output['file'].flush()
+
+        return follow_tc_file(file_path, write_measurements, variables, interval, idle_timeout)
+    finally:
+        if output and output['file'] is not sys.stdout:
+            output['file'].close()
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Converts Kingbolen/ThinkCar .TC recordings from input/ to CSV files in output/.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of files converted in parallel (default: number of CPU cores)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="convert all files again, even those that did not change since the last run")
+    parser.add_argument("-s", "--select", action="append", metavar="VARIABLE",
+                        help="only write this variable, given by name (with or without unit) or regular expression. "
+                             "Can be repeated.")
+    parser.add_argument("--profile", action="store_true", default=os.environ.get("TC_PROFILE", "") not in ("", "0"),
+                        help="print the time, size, speed and peak memory of every conversion stage "
+                             "(also enabled by the TC_PROFILE environment variable, unless it is 0)")
+    parser.add_argument("--profile-json", metavar="PATH", default=os.environ.get("TC_PROFILE_JSON"),
+                        help="append the stage measurements to PATH as JSON lines, implies --profile "
+                             "(default: the TC_PROFILE_JSON environment variable)")
+    parser.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default='csv', dest="output_format",
+                        help="output file format (default: csv). parquet and arrow need pyarrow installed, "
+                             "changes writes only the changed values (see tc_to_changes).")
+    parser.add_argument("-o", "--output-dir", default=OUTPUT_DIRECTORY,
+                        help=f"directory of the converted files (default: {OUTPUT_DIRECTORY})")
+    parser.add_argument("--compress", choices=sorted(CSV_COMPRESSIONS), default=None,
+                        help="compress the CSV files (.csv.gz or .csv.zst). zstd needs zstandard installed.")
+    parser.add_argument("--no-pyramid", action="store_false", dest="pyramid",
+                        help="do not write the summary pyramid of each CSV file, which the viewer uses for long "
+                             "recordings")
+    parser.add_argument("--follow", metavar="TC_FILE",
+                        help="decode TC_FILE while it is being recorded, appending new measurements as CSV "
+                             "until interrupted (Ctrl+C)")
+    parser.add_argument("--follow-output", metavar="PATH",
+                        help="CSV file written by --follow, - for the standard output (default: <output-dir>/<name>.csv)")
+    parser.add_argument("--interval", type=float, default=0.2,
+                        help="seconds between two checks of the followed file (default: 0.2)")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="stop following when the file did not grow for this many seconds")
+    args = parser.parse_args(argv)
+
+    if args.follow:
+        try:
+            measurements = follow_to_csv(args.follow, args.follow_output, args.select, args.interval,
+                                         args.idle_timeout, args.output_dir)
+        except (OSError, ValueError) as e:
+            print(f"❌ Can not follow {args.follow}: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Followed {args.follow}: {measurements} measurement(s) written.", file=sys.stderr)
+        return
 
-    return {
-        'ParametersMap': ParametersMap,
-        'MeasurementsSeq': MeasurementsSeq,
-        'VariablesAndUnitsSeq': VariablesAndUnitsSeq,
-    }
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    if args.output_format in ('parquet', 'arrow') and pa is None:
+        parser.error(f"--format {args.output_format} requires pyarrow (pip install pyarrow)")
+
+    if args.compress is not None and args.output_format != 'csv':
+        parser.error("--compress only applies to --format csv")
+    if args.compress == 'zstd' and zstandard is None:
+        parser.error("--compress zstd requires zstandard (pip install zstandard)")
+
+    process_tc_files(jobs=args.jobs, force=args.force, variables=args.select, output_format=args.output_format,
+                     profile=args.profile or bool(args.profile_json), profile_json=args.profile_json,
+                     output_dir=args.output_dir, compression=args.compress, pyramid=args.pyramid)
 
 
 if __name__ == "__main__":
-    process_tc_files()
+    main()
@@ -0,0 +1,254 @@
+import os
+import glob
+import time
+import hashlib
+import sqlite3
+import argparse
+
+import decoder
+
+# Default location of the store, next to the converted files
+DATABASE_PATH = "output/recordings.sqlite"
+
+AGGREGATES = ('min', 'max', 'mean', 'count')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL,
+    decoder_version TEXT NOT NULL,
+    measurements INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS variables (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    unit TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS variables_by_name ON variables(name, unit);
+CREATE INDEX IF NOT EXISTS variables_by_file ON variables(file_id);
+
+-- A variable keeps its value from first_row to last_row (measurement numbers, inclusive).
+-- value is NULL for values that are not numbers (e.g. "ON"/"OFF"), text always holds the original string.
+CREATE TABLE IF NOT EXISTS runs (
+    variable_id INTEGER NOT NULL REFERENCES variables(id) ON DELETE CASCADE,
+    first_row INTEGER NOT NULL,
+    last_row INTEGER NOT NULL,
+    value REAL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (variable_id, first_row)
+) WITHOUT ROWID;
+"""
+
+
+def connect(database_path: str = DATABASE_PATH) -> sqlite3.Connection:
+    """Opens (and creates when needed, with its directory) the store of decoded recordings."""
+    os.makedirs(os.path.dirname(database_path) or ".", exist_ok=True)
+    connection = sqlite3.connect(database_path)
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def ingest_files(tc_files: list[str], database_path: str = DATABASE_PATH, jobs: int = None, force: bool = False):
+    """
+    Decodes TC files and loads them into the store. Files that are already stored and did not
+    change since are skipped, changed files replace their previous version.
+
+    Args:
+        tc_files: Paths of the .TC files.
+        database_path: The SQLite file of the store.
+        jobs: How many files are decoded in parallel. Defaults to the number of CPU cores.
+        force: Load all files again, even the unchanged ones.
+    """
+    started = time.perf_counter()
+    connection = connect(database_path)
+
+    stored = {path: (size, mtime, sha256, version) for path, size, mtime, sha256, version
+              in connection.execute("SELECT path, size, mtime, sha256, decoder_version FROM files")}
+    tc_files = sorted(tc_files)
+    pending = [file_path for file_path in tc_files if force or not is_stored(file_path, stored.get(file_path))]
+
+    ingested = 0
+    total_runs = 0
+    try:
+        with decoder.parallel_map(decode_runs, pending, jobs) as results:
+            for result in results:
+                print(f"Ingesting file: {result['path']}")
+                if result['error'] is not None:
+                    print(f"  ❌ {result['error']}")
+                    continue
+                with connection:
+                    store_runs(connection, result)
+                ingested += 1
+                total_runs += len(result['runs'])
+    finally:
+        connection.close()
+
+    print(f"Ingested {ingested} of {len(pending)} file(s) ({total_runs} runs) in "
+          f"{time.perf_counter() - started:.2f} seconds, {len(tc_files) - len(pending)} unchanged file(s) skipped.")
+
+
+def is_stored(file_path: str, stored: tuple) -> bool:
+    """Checks whether the stored version of a file is still up to date, see decoder.stat_if_unchanged."""
+    if stored is None:
+        return False
+    size, mtime, sha256, version = stored
+    if version != decoder.DECODER_VERSION:
+        return False
+    return decoder.stat_if_unchanged(file_path, size, mtime, sha256) is not None
+
+
+def decode_runs(file_path: str) -> dict:
+    """
+    Decodes a TC file into runs of unchanged values. Runs in a worker process and never raises.
+
+    Returns:
+        A dictionary with 'path', 'size', 'mtime', 'sha256', 'measurements', 'variables'
+        ((name, unit) pairs), 'runs' ((position, first_row, last_row, value, text) tuples)
+        and 'error' (None on success, otherwise the message to report).
+    """
+    result = {'path': file_path, 'size': 0, 'mtime': None, 'sha256': None, 'measurements': 0,
+              'variables': [], 'runs': [], 'error': None}
+
+    try:
+        result['mtime'] = os.stat(file_path).st_mtime
+        with decoder.open_tc_file(file_path) as content:
+            result['size'] = len(content)
+            result['sha256'] = hashlib.sha256(content).hexdigest()
+            result['variables'], result['measurements'], result['runs'] = runs_from_content(content)
+
+    except Exception as e:
+        result['error'] = decoder.error_message(file_path, e)
+
+    return result
+
+
+def runs_from_content(content) -> tuple[list, int, list]:
+    """
+    Turns the change events of a recording into runs: one per value a variable kept over
+    consecutive measurements. Stretches where a variable was not measured are left out.
+    """
+    decoded = decoder.decode_tc_content(content)
+    number_of_variables = len(decoded['variables'])
+    measurement_count = decoder.count_measurements(decoded['measurements_seq'], number_of_variables)
+
+    value_table = decoded['value_table']
+    texts = value_table['texts']
+    values = [None if kind in (decoder.VALUE_EMPTY, decoder.VALUE_LABEL) else value
+              for kind, value in zip(value_table['kinds'], value_table['values'])]
+
+    runs = []
+    # The current run of each variable: (parameters map index, first measurement)
+    current = [(0, 1)] * number_of_variables
+
+    for measurement, position, index in decoder.iter_changes(decoded['measurements_seq'], number_of_variables):
+        previous_index, first_row = current[position]
+        if previous_index != 0:
+            runs.append((position, first_row, measurement - 1, values[previous_index], texts[previous_index]))
+        current[position] = (index, measurement)
+
+    for position, (index, first_row) in enumerate(current):
+        if index != 0:
+            runs.append((position, first_row, measurement_count, values[index], texts[index]))
+
+    return decoded['variables_and_units'], measurement_count, runs
+
+
+def store_runs(connection: sqlite3.Connection, result: dict) -> None:
+    """Replaces the stored version of a file with a result of decode_runs, using bulk inserts."""
+    connection.execute("DELETE FROM files WHERE path = ?", (result['path'],))
+    file_id = connection.execute(
+        "INSERT INTO files (path, size, mtime, sha256, decoder_version, measurements) VALUES (?, ?, ?, ?, ?, ?)",
+        (result['path'], result['size'], result['mtime'], result['sha256'], decoder.DECODER_VERSION,
+         result['measurements'])).lastrowid
+
+    variable_ids = []
+    for position, (name, unit) in enumerate(result['variables']):
+        variable_ids.append(connection.execute(
+            "INSERT INTO variables (file_id, position, name, unit) VALUES (?, ?, ?, ?)",
+            (file_id, position, name, unit)).lastrowid)
+
+    connection.executemany(
+        "INSERT INTO runs (variable_id, first_row, last_row, value, text) VALUES (?, ?, ?, ?, ?)",
+        ((variable_ids[position], first_row, last_row, value, text)
+         for position, first_row, last_row, value, text in result['runs']))
+
+
+def query_aggregate(variable: str, aggregate: str = 'max', database_path: str = DATABASE_PATH) -> list[tuple]:
+    """
+    Aggregates one variable per stored file, without decoding anything.
+
+    Args:
+        variable: The variable name, without unit. SQL LIKE wildcards (% and _) are allowed.
+        aggregate: One of AGGREGATES. The mean and count are weighted by how many measurements
+                   each value was held for, so they match the full table.
+
+    Returns:
+        (file path, variable name, unit, result) tuples, ordered by file path and variable.
+        Values that are not numbers are ignored, except by count.
+    """
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate: {aggregate}. Use one of {', '.join(AGGREGATES)}.")
+
+    expression = {
+        'min': "MIN(runs.value)",
+        'max': "MAX(runs.value)",
+        'mean': "SUM(runs.value * (runs.last_row - runs.first_row + 1)) "
+                "/ SUM(CASE WHEN runs.value IS NULL THEN NULL ELSE runs.last_row - runs.first_row + 1 END)",
+        'count': "SUM(runs.last_row - runs.first_row + 1)",
+    }[aggregate]
+
+    connection = connect(database_path)
+    try:
+        return connection.execute(
+            f"SELECT files.path, variables.name, variables.unit, {expression} "
+            "FROM variables "
+            "JOIN files ON files.id = variables.file_id "
+            "JOIN runs ON runs.variable_id = variables.id "
+            "WHERE variables.name LIKE ? "
+            "GROUP BY variables.id "
+            "ORDER BY files.path, variables.name",
+            (variable,)).fetchall()
+    finally:
+        connection.close()
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Stores decoded .TC recordings in SQLite and queries them across files.")
+    parser.add_argument("--db", default=DATABASE_PATH, help=f"the SQLite store (default: {DATABASE_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="load new and changed TC files into the store")
+    ingest.add_argument("files", nargs="*", help="TC files to load (default: input/*.TC)")
+    ingest.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of files decoded in parallel (default: number of CPU cores)")
+    ingest.add_argument("-f", "--force", action="store_true", help="load all files again, even the unchanged ones")
+
+    query = commands.add_parser("query", help="aggregate one variable per file")
+    query.add_argument("variable", help="variable name without unit, SQL LIKE wildcards allowed")
+    query.add_argument("--agg", choices=AGGREGATES, default='max', help="aggregate (default: max)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "ingest":
+        if args.jobs is not None and args.jobs < 1:
+            parser.error("--jobs must be at least 1")
+        ingest_files(args.files or glob.glob("input/*.TC"), args.db, jobs=args.jobs, force=args.force)
+    else:
+        rows = query_aggregate(args.variable, args.agg, args.db)
+        if not rows:
+            print(f"No stored file has a variable matching: {args.variable}")
+        for path, name, unit, value in rows:
+            print(f"{path}\t{name} ({unit})\t{args.agg} = {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,23 @@ import os
 import glob
 import pandas as pd  # Import pandas for data loading
 
+import decoder
+import viewer_data
+
 # --- Configuration and Setup ---
 
 # Set the title of the Streamlit application
-st.title("CSV File Processor 📊")
+st.title("TC/CSV File Processor 📊")
 
-# Define the directory to scan for CSV files
-# NOTE: The 'output' directory must exist and contain CSV files for this to work
+# Define the directories to scan for TC files (decoded directly) and converted CSV files
+# NOTE: The 'input' or 'output' directory must exist and contain files for this to work
+input_directory = 'input'
 data_directory = 'output'
-csv_files = glob.glob(os.path.join(data_directory, "*.csv"))
+tc_files = sorted(glob.glob(os.path.join(input_directory, "*.TC")))
+recording_files = tc_files + sorted(glob.glob(os.path.join(data_directory, "*.csv")))
+
+# Most points drawn per column, longer ranges are drawn from the pyramid or every n-th row
+CHART_POINTS = 1000
 
 # --- State Management Initialization ---
 
@@ -22,40 +30,49 @@ if 'file_selected' not in st.session_state:
 if 'selected_file_path' not in st.session_state:
     # Stores the path of the confirmed file
     st.session_state.selected_file_path = None
-if 'dataframe' not in st.session_state:
-    # Stores the loaded dataframe
-    st.session_state.dataframe = None
+# The recordings themselves are cached by viewer_data, across reruns and sessions
 
 
 # --- Function to Handle Processing ---
 
 def load_and_process_file(file_path):
-    """Loads the CSV, stores it in state, and transitions to the processing phase."""
+    """Opens the TC or CSV file (decoded or read lazily by viewer_data), stores its path in state, and transitions to the processing phase."""
     try:
-        # Load the CSV file into a pandas DataFrame
-        df = pd.read_csv(file_path)
+        viewer_data.open_recording(file_path)
 
         # Update session state to reflect the transition
         st.session_state.file_selected = True
         st.session_state.selected_file_path = file_path
-        st.session_state.dataframe = df
+        # The row range of the previous file may not fit this one
+        st.session_state.pop('row_range', None)
 
         # NOTE: A simple 'success' message isn't needed here
         # because the app will re-run and show the new content.
 
     except FileNotFoundError:
         st.error(f"File not found: {file_path}")
-    except pd.errors.EmptyDataError:
-        st.error(f"The file **{file_path}** is empty.")
     except Exception as e:
         st.error(f"An error occurred while loading the file: {e}")
 
 
+def open_selected_recording():
+    """The recording of the selected file from the cache, None (after showing the error) when it cannot be opened."""
+    try:
+        recording = viewer_data.open_recording(st.session_state.selected_file_path)
+        if recording['pyramid'] is None:
+            # Without a pyramid, the summary table needs every value
+            viewer_data.load_columns(recording, recording['columns'])
+        return recording
+    except Exception as e:
+        st.error(f"An error occurred while loading the file: {e}")
+        return None
+
+
 # --- Application Flow Control ---
 
-if not csv_files:
+if not recording_files:
     # Handle the case where no CSV files are found
-    st.error(f"No CSV files found in the directory: **{os.path.abspath(data_directory)}**")
+    st.error(f"No TC files found in **{os.path.abspath(input_directory)}** and no CSV files in **{os.path.abspath(data_directory)}**")
 
 elif not st.session_state.file_selected:
     # --- 1. File Selection Phase (Initial state) ---
@@ -65,8 +82,8 @@ elif not st.session_state.file_selected:
     # Get the currently selected file path from the radio button
     # Note: This is *not* the confirmed file yet, just the one highlighted
     tentative_selection = st.radio(
-        "**Select a CSV file to process:**",
-        csv_files
+        "**Select a TC or CSV file to process:**",
+        recording_files
     )
 
     st.write(f"You have tentatively selected: **{tentative_selection}**")
@@ -80,11 +97,12 @@ elif not st.session_state.file_selected:
             st.warning("Please select a file before processing.")
 
 else:
-    # Check if the DataFrame exists and has data
-    if 'dataframe' in st.session_state and st.session_state.dataframe is not None and not st.session_state.dataframe.empty:
+    recording = open_selected_recording()
+
+    # Check if the recording was opened and has data
+    if recording is not None and recording['rows'] > 0:
 
-        df = st.session_state.dataframe
-        total_rows = len(df)
+        total_rows = recording['rows']
 
         st.success(f"✅ Data loaded successfully for file: **{st.session_state.selected_file_path}**")
 
@@ -116,38 +134,47 @@ else:
         start_row_index = selected_range[0]
         end_row_index = selected_range[1]
 
-        # Filter the DataFrame based on the selected indices
-        # We use .iloc to select rows by their integer position
-        filtered_df = df.iloc[start_row_index: end_row_index + 1]  # +1 because slicing is exclusive at the end
+        pyramid = recording['pyramid']
+        numeric_columns = viewer_data.numeric_columns(recording)
+        range_rows = end_row_index - start_row_index + 1
 
         # --- Data Line Chart Display ---
         st.subheader("Data Line Chart Preview")
 
-        try:
-            # Filter the (already row-filtered) DataFrame to include only numeric columns
-            numeric_df = filtered_df.select_dtypes(include=['number'])
-
-            if not numeric_df.empty:
-                # Display the line chart for the selected range and numeric columns
-                #st.line_chart(numeric_df)
-                st.write(
-                    f"Displaying **{len(numeric_df)}** rows (Rows **{start_row_index}** to **{end_row_index}**) across **{len(numeric_df.columns)}** numeric columns.")
-            else:
-                st.warning("⚠️ The selected range contains no numeric data to display a line chart.")
+        # The chart shows the columns selected in the summary table below, so it is drawn after it
+        chart_container = st.container()
 
-        except Exception as e:
-            st.error(f"⚠️ An error occurred while plotting: {e}")
+        if numeric_columns:
+            st.write(
+                f"Displaying **{range_rows}** rows (Rows **{start_row_index}** to **{end_row_index}**) across **{len(numeric_columns)}** numeric columns.")
+        else:
+            st.warning("⚠️ The selected range contains no numeric data to display a line chart.")
 
         st.markdown("---")
 
         # --- Filtered Data Summary Table ---
         st.subheader("Filtered Data Summary Table")
 
-        if not numeric_df.empty:
+        if numeric_columns:
             try:
-                summary_df = numeric_df.agg(['mean', 'min', 'max']).T.reset_index()
-                # Rename the columns for better display
-                summary_df.columns = ['Dataset Name', 'Average Value', 'Minimal Value', 'Maximal Value']
+                if pyramid is not None:
+                    # Whole buckets come from the pyramid, only the rows before and after them are read
+                    start, stop = start_row_index, end_row_index + 1
+                    edges = viewer_data.edge_values(recording, numeric_columns,
+                                                    decoder.pyramid_edges(pyramid, start, stop))
+                    summaries = [decoder.pyramid_summary(pyramid, column, start, stop, edges[column])
+                                 for column in numeric_columns]
+                    summary_df = pd.DataFrame({
+                        'Dataset Name': numeric_columns,
+                        'Average Value': [summary['mean'] for summary in summaries],
+                        'Minimal Value': [summary['min'] for summary in summaries],
+                        'Maximal Value': [summary['max'] for summary in summaries],
+                    })
+                else:
+                    numeric_df = viewer_data.row_slice(recording, numeric_columns, start_row_index, end_row_index + 1)
+                    summary_df = numeric_df.agg(['mean', 'min', 'max']).T.reset_index()
+                    # Rename the columns for better display
+                    summary_df.columns = ['Dataset Name', 'Average Value', 'Minimal Value', 'Maximal Value']
 #                summary_df['Select'] = False  # Initialize the selection column
 
                 summary_df['Select'] = (summary_df['Minimal Value'] != summary_df['Maximal Value'])
@@ -173,6 +200,24 @@ else:
 
                 selected_rows = edited_df[edited_df['Select']]
 
+                with chart_container:
+                    selected_columns = list(selected_rows['Dataset Name'])
+                    if selected_columns and pyramid is not None and range_rows > CHART_POINTS:
+                        # Bucket means from the pyramid, whatever the range only the buckets are read
+                        chart_df = None
+                        for column in selected_columns:
+                            series = decoder.pyramid_series(pyramid, column, start_row_index, end_row_index + 1,
+                                                            CHART_POINTS)
+                            column_df = pd.DataFrame({column: series['mean']}, index=series['measurement'])
+                            chart_df = column_df if chart_df is None else chart_df.join(column_df)
+                        st.line_chart(chart_df)
+                    elif selected_columns:
+                        # Only the selected columns are loaded, and the chart gets a view of every n-th row
+                        viewer_data.load_columns(recording, selected_columns)
+                        step = -(-range_rows // CHART_POINTS)
+                        st.line_chart(viewer_data.row_slice(recording, selected_columns, start_row_index,
+                                                            end_row_index + 1, step))
+
             except Exception as e:
                 st.error(f"⚠️ An error occurred while generating the summary table: {e}")
         else:
@@ -185,16 +230,15 @@ else:
             # Reset the state variables to revert to the selection phase
             st.session_state.file_selected = False
             st.session_state.selected_file_path = None
-            st.session_state.dataframe = None
             # Streamlit automatically re-runs after a button click
     else:
         st.error("Data is not loaded or is empty.")
 
     # The following lines are outside the main 'if' block and should likely be updated/adjusted
-    # or wrapped in a conditional check for st.session_state.dataframe existence.
-    if 'dataframe' in st.session_state and st.session_state.dataframe is not None:
-        st.write(f"Number of rows: {len(st.session_state.dataframe)}")
-        # st.write(f"Number of columns: {len(st.session_state.dataframe.columns)}")
+    # or wrapped in a conditional check for the recording existence.
+    if recording is not None:
+        st.write(f"Number of rows: {recording['rows']}")
+        # st.write(f"Number of columns: {len(recording['columns'])}")
 
     st.markdown("---")
 
@@ -203,6 +247,5 @@ else:
         # Reset the state variables to revert to the selection phase
         st.session_state.file_selected = False
         st.session_state.selected_file_path = None
-        st.session_state.dataframe = None
         # Streamlit automatically re-runs after a button click,
         # and the 'elif not st.session_state.file_selected:' block will run next.
\ No newline at end of file
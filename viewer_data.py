@@ -0,0 +1,274 @@
+import io
+import os
+import csv
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import decoder
+
+# How many recordings the viewer keeps loaded, shared by all reruns and sessions
+MAX_RECORDINGS = 4
+
+# Where decoded TC files are cached as Arrow IPC files (needs pyarrow)
+CACHE_DIRECTORY = "output/.cache"
+
+# Open recordings by (absolute path, mtime), the least recently used first
+recordings = OrderedDict()
+recordings_lock = threading.Lock()
+
+
+def open_recording(file_path: str) -> dict:
+    """
+    Opens a recording for the viewer: a .TC file (see open_tc_recording) or a converted CSV file
+    (see open_csv_recording). Recordings are cached by path and mtime, so a changed file is opened
+    again, and the least recently used ones are dropped past MAX_RECORDINGS.
+
+    Returns:
+        A dictionary with 'path', 'mtime', 'columns' (names in file order), 'rows', 'pyramid' (None when
+        there is none or it belongs to another version of the file), 'data' (the columns loaded so far,
+        see load_columns) and for CSV files 'offsets' (see line_offsets).
+    """
+    path = os.path.abspath(file_path)
+    key = (path, os.stat(path).st_mtime_ns)
+
+    with recordings_lock:
+        if key in recordings:
+            recordings.move_to_end(key)
+            return recordings[key]
+
+    if path.lower().endswith(".tc"):
+        recording = open_tc_recording(path)
+    else:
+        recording = open_csv_recording(path)
+    recording.update({'path': path, 'mtime': key[1], 'lock': threading.Lock()})
+
+    with recordings_lock:
+        for old_key in [old_key for old_key in recordings if old_key[0] == path]:
+            del recordings[old_key]
+        recordings[key] = recording
+        while len(recordings) > MAX_RECORDINGS:
+            recordings.popitem(last=False)
+    return recording
+
+
+def open_csv_recording(path: str) -> dict:
+    """Reads only the header, the line offsets and the pyramid of a CSV file, the values are read by load_columns."""
+    with open(path, newline="", encoding="utf-8") as f:
+        columns = next(csv.reader(f), [])
+    offsets = line_offsets(path)
+    rows = len(offsets) - 1
+
+    # The decoder writes the pyramid next to the converted file
+    pyramid = decoder.load_pyramid(path)
+    # --follow rewrites the CSV without a pyramid, an older one would not match its rows or columns
+    if pyramid is not None and (pyramid['measurements'] != rows or pyramid['columns'] != columns[1:]):
+        pyramid = None
+
+    return {'columns': columns, 'rows': rows, 'pyramid': pyramid, 'data': {}, 'table': None, 'offsets': offsets}
+
+
+def open_tc_recording(path: str) -> dict:
+    """
+    Decodes a TC file straight into typed columns (see decoder.decode_columns) and its pyramid, without
+    the CSV round trip. With pyarrow installed, both are cached in CACHE_DIRECTORY, so opening the file
+    again only maps the cache (see load_cache) and the columns are read from it by load_columns.
+    """
+    source = cache_source(path)
+    if decoder.pa is not None:
+        cached = load_cache(path, source)
+        if cached is not None:
+            return cached
+
+    with decoder.open_tc_file(path) as content:
+        columns, pyramid = decode_recording(content)
+
+    if decoder.pa is not None:
+        save_cache(path, source, columns, pyramid)
+        return load_cache(path, source)
+
+    data = {name: values if isinstance(values, np.ndarray) else pd.Categorical.from_codes(*values)
+            for name, values in columns.items()}
+    return {'columns': list(data), 'rows': pyramid['measurements'], 'pyramid': pyramid, 'data': data, 'table': None}
+
+
+def decode_recording(content) -> tuple[dict, dict]:
+    """The typed columns (see decoder.decode_columns) and the pyramid of every variable of a TC file."""
+    decoded = decoder.decode_tc_content(content)
+    columns = decoder.decode_columns(decoded['parameters_map'], decoded['measurements_seq'], decoded['variables'],
+                                     decoded['value_table'])
+    pyramid = decoder.build_pyramid(decoded, list(range(len(decoded['variables']))))
+    return columns, pyramid
+
+
+def cache_source(path: str) -> dict:
+    """What a cache has to be built from to be valid: the TC file as it is now, and this decoder version."""
+    stat = os.stat(path)
+    return {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'decoder_version': decoder.DECODER_VERSION}
+
+
+def cache_paths(path: str) -> tuple[str, str]:
+    """The cache files of a TC file: output/.cache/<name>.arrow and output/.cache/<name>.pyramid.arrow."""
+    base = decoder.recording_name(path)
+    return f"{CACHE_DIRECTORY}/{base}.arrow", f"{CACHE_DIRECTORY}/{base}.pyramid.arrow"
+
+
+def save_cache(path: str, source: dict, columns: dict, pyramid: dict) -> None:
+    """
+    Writes the decoded columns and the pyramid (see decoder.pyramid_to_table) as Arrow IPC files, each
+    into a temporary file first, so a reader never maps a partial one. Numbers keep NaN instead of nulls,
+    so they map without copying.
+    """
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    pa = decoder.pa
+    metadata = {'source': json.dumps(source)}
+
+    arrays = []
+    for values in columns.values():
+        if isinstance(values, np.ndarray):
+            arrays.append(pa.array(values))
+        else:
+            codes, categories = values
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0),
+                                                         pa.array(categories, type=pa.string())))
+    table = pa.Table.from_arrays(arrays, names=list(columns), metadata=metadata)
+    pyramid_table = decoder.pyramid_to_table(pyramid, metadata)
+
+    for cache_path, cache_table in zip(cache_paths(path), (table, pyramid_table)):
+        decoder.write_arrow_file(cache_path, cache_table)
+
+
+def load_cache(path: str, source: dict) -> dict:
+    """
+    Maps the cache of a TC file, None when there is none or it was built from another version of the file.
+    Nothing is read yet: the columns are read by load_columns, the pyramid levels are views of the map.
+    """
+    tables = []
+    for cache_path in cache_paths(path):
+        try:
+            table = decoder.pa.ipc.open_file(decoder.pa.memory_map(cache_path)).read_all()
+        except (OSError, decoder.pa.ArrowInvalid):
+            return None
+        metadata = table.schema.metadata or {}
+        if json.loads(metadata.get(b'source', b'null')) != source:
+            return None
+        tables.append(table)
+    table, pyramid_table = tables
+
+    pyramid = decoder.pyramid_from_table(pyramid_table)
+    return {'columns': table.column_names, 'rows': pyramid['measurements'], 'pyramid': pyramid, 'data': {},
+            'table': table}
+
+
+def line_offsets(file_path: str) -> np.ndarray:
+    """
+    Where each row of a CSV file written by the decoder starts, and where the last one ends, found without
+    parsing them (values never hold line breaks). Row i is bytes offsets[i]..offsets[i + 1] - 1.
+    """
+    offsets = []
+    position = 0
+    last = b"\n"
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            offsets.append(np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n")) + position + 1)
+            position += len(chunk)
+            last = chunk[-1:]
+    offsets = np.concatenate(offsets) if offsets else np.zeros(0, dtype=np.int64)
+    if last != b"\n":
+        offsets = np.append(offsets, position)
+    # The first line is the header
+    return offsets if len(offsets) else np.zeros(1, dtype=np.int64)
+
+
+def numeric_columns(recording: dict) -> list[str]:
+    """The numeric columns, known from the pyramid without loading anything, otherwise from the loaded data."""
+    if recording['pyramid'] is not None:
+        return [column for column in recording['columns'] if column in recording['pyramid']['variables']]
+    return [column for column, values in recording['data'].items() if values.dtype.kind in 'iuf']
+
+
+def load_columns(recording: dict, columns: list[str]) -> None:
+    """
+    Loads the values of some columns into recording['data'] (numpy arrays, or categoricals for labels),
+    in one pass over the CSV file or from the mapped cache of a TC file. Columns that are already loaded
+    are not read again.
+    """
+    with recording['lock']:
+        positions = {}
+        for column in columns:
+            if column not in recording['data'] and column not in positions and column in recording['columns']:
+                positions[column] = recording['columns'].index(column)
+        if not positions:
+            return
+
+        if recording['table'] is not None:
+            for column, position in positions.items():
+                recording['data'][column] = arrow_to_values(recording['table'].column(position).combine_chunks())
+            return
+
+        # The pyarrow parser is about twice as fast, when it is installed
+        engine = "pyarrow" if decoder.pa is not None else "c"
+        order = sorted(positions, key=positions.get)
+        frame = pd.read_csv(recording['path'], header=None, skiprows=1, usecols=[positions[column] for column in order],
+                            engine=engine)
+        # Both parsers keep the order of the file
+        for number, column in enumerate(order):
+            recording['data'][column] = frame.iloc[:, number].to_numpy()
+
+
+def arrow_to_values(values):
+    """A cached column as numpy: numbers without copying, labels as a categorical."""
+    if decoder.pa.types.is_dictionary(values.type):
+        return pd.Categorical.from_codes(values.indices.fill_null(-1).to_numpy(),
+                                         values.dictionary.to_pylist())
+    return values.to_numpy()
+
+
+def row_slice(recording: dict, columns: list[str], start: int, stop: int, step: int = 1) -> pd.DataFrame:
+    """
+    The rows start..stop-1 (every step-th one) of loaded columns, as a DataFrame over views of the
+    cached arrays: nothing is copied, so it must not be modified.
+    """
+    data = recording['data']
+    frame = pd.DataFrame({column: data[column][start:stop:step] for column in columns}, copy=False)
+    frame.index = range(start, start + len(frame) * step, step)
+    return frame
+
+
+def edge_values(recording: dict, columns: list[str], ranges: list[tuple[int, int]]) -> dict:
+    """
+    The values of some columns in a few short ranges of rows (see decoder.pyramid_edges), one range after
+    the other, without loading the columns: from the loaded data or the mapped cache, otherwise read
+    straight from the CSV file at its line offsets.
+
+    Returns:
+        A dictionary of lists of values (NaN where a variable was not measured) by column.
+    """
+    values = {column: [] for column in columns}
+    positions = {column: recording['columns'].index(column) for column in columns}
+    for start, stop in ranges:
+        missing = []
+        for column in columns:
+            if column in recording['data']:
+                values[column].extend(recording['data'][column][start:stop].tolist())
+            elif recording['table'] is not None:
+                column_values = recording['table'].column(positions[column]).slice(start, stop - start)
+                values[column].extend(column_values.to_pylist())
+            else:
+                missing.append(column)
+        if not missing or start >= stop:
+            continue
+
+        offsets = recording['offsets']
+        with open(recording['path'], 'rb') as f:
+            f.seek(offsets[start])
+            rows = f.read(offsets[stop] - offsets[start])
+        order = sorted(missing, key=positions.get)
+        frame = pd.read_csv(io.BytesIO(rows), header=None, usecols=[positions[column] for column in order])
+        for number, column in enumerate(order):
+            values[column].extend(frame.iloc[:, number].tolist())
+    return values